@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for rp2040bit-main.py on CPython
+
+    $ python3 ./bench.py [name ...]
+"""
+
+import io
+import sys
+import time
+import random
+
+import figures
+from harness import load_game, load_terminal
+
+game = load_game()
+
+
+def measure(fn, repeat=200) -> float:
+    """Return microseconds per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1_000_000 / repeat
+
+
+def report(name: str, baseline: float, current: float):
+    print(f"  {name:<32} {baseline:10.1f} us {current:10.1f} us  x{baseline / current:.1f}")
+
+
+def render_tuples(buf):
+    """render() as it was: serpentine fix and a color tuple per pixel"""
+    for x in range(game.SCREEN_WIDTH):
+        for y in range(game.SCREEN_HEIGHT):
+            color = buf.get(x, y)
+            if y % 2 == 0:
+                x = 7 - x
+            game.np[game.SCREEN_WIDTH * y + x] = game.COLORS[color]
+    game.np.write()
+
+
+def bench_render():
+    print("render: tuples per pixel vs wire format")
+    buf = game.FrameBuffer()
+    for idx in range(game.SCREEN_SIZE):
+        buf.content[idx] = random.randrange(len(game.COLORS))
+
+    def full():
+        game.FrameBuffer.invalidate()
+        buf.render()
+
+    def sparse():
+        buf.set(random.randrange(game.SCREEN_WIDTH), random.randrange(game.SCREEN_HEIGHT),
+                random.randrange(len(game.COLORS)))
+        buf.render()
+
+    baseline = measure(lambda: render_tuples(buf))
+    report("full frame", baseline, measure(full))
+    report("one pixel changed", baseline, measure(sparse))
+    report("unchanged frame", baseline, measure(buf.render))
+
+
+def is_full(m: memoryview):
+    """The byte row scan the Tetris well used before Bitboard"""
+    return all(b != 0 for b in m)
+
+
+def is_empty(m: memoryview):
+    return all(b == 0 for b in m)
+
+
+def bench_well():
+    print("tetris well: FrameBuffer vs Bitboard")
+    random.seed(1)
+    buf = game.FrameBuffer()
+    well = game.Bitboard()
+    for y in range(20, game.SCREEN_HEIGHT):
+        for x in range(game.SCREEN_WIDTH):
+            if random.randrange(4):
+                buf.set(x, y, game.BRICK_IDX)
+                well.rows[y] |= 1 << x
+
+    probes = [(random.choice(figures.TETRAMINO), random.randrange(6), random.randrange(6, 29))
+              for _ in range(64)]
+
+    def collides(board):
+        def run():
+            for shape, x, y in probes:
+                board.collides(x, y, shape)
+        return run
+
+    def scan_bytes():
+        for row in range(6, game.SCREEN_HEIGHT):
+            is_full(buf.row(row))
+            is_empty(buf.row(row))
+
+    def scan_bits():
+        for row in range(6, game.SCREEN_HEIGHT):
+            well.is_full(row)
+            well.is_empty(row)
+
+    report("collides x64", measure(collides(buf)), measure(collides(well)))
+    report("full/empty row scan", measure(scan_bytes), measure(scan_bits))
+
+
+def draw_dense(buf, x, y, figure):
+    """FrameBuffer.draw as it was: every cell through figure.get()"""
+    for row in range(figure.height):
+        for col in range(figure.width):
+            ch = figure.get(col, row)
+            if ch:
+                buf.set(x + col, y + row, ch)
+
+
+def collides_dense(buf, x, y, figure):
+    for row in range(figure.height):
+        for col in range(figure.width):
+            ch = figure.get(col, row)
+            if ch and not buf.available(x + col, y + row):
+                return True
+    return False
+
+
+def bench_figures():
+    print("figures: dense cells vs occupied offsets")
+    buf = game.FrameBuffer()
+    sprites = figures.DIGITS + figures.TETRAMINO + [figures.TANK]
+
+    def draw(fn):
+        def run():
+            for sprite in sprites:
+                fn(buf, 2, 10, sprite)
+        return run
+
+    def collides(fn):
+        def run():
+            for sprite in sprites:
+                fn(buf, 2, 20, sprite)
+        return run
+
+    report("draw", measure(draw(draw_dense)),
+           measure(draw(lambda buf, x, y, sprite: buf.draw(x, y, sprite))))
+    report("collides (free area)", measure(collides(collides_dense)),
+           measure(collides(lambda buf, x, y, sprite: buf.collides(x, y, sprite))))
+
+
+def bench_bulk():
+    print("framebuffer: per-byte loops vs slice operations")
+    buf = game.FrameBuffer()
+    other = game.FrameBuffer()
+    width = game.SCREEN_WIDTH
+
+    def clear_loop():
+        for idx in range(game.SCREEN_SIZE):
+            buf.content[idx] = 0
+
+    def fill_loop():
+        for y in range(6, 20):
+            for x in range(1, 7):
+                buf.set(x, y, game.RED_IDX)
+
+    def scroll_loop():
+        for idx in range(game.SCREEN_SIZE - 1, width - 1, -1):
+            buf.content[idx] = buf.content[idx - width]
+        for idx in range(width):
+            buf.content[idx] = 0
+
+    def compare_loop():
+        return all(buf.content[idx] == other.content[idx] for idx in range(game.SCREEN_SIZE))
+
+    obstacle = figures.DIGITS[8]
+
+    report("clear", measure(clear_loop), measure(buf.clear))
+    report("fill 6x14", measure(fill_loop), measure(lambda: buf.fill(1, 6, 6, 14, game.RED_IDX)))
+    report("scroll 1 row", measure(scroll_loop), measure(buf.scroll))
+    report("compare", measure(compare_loop), measure(lambda: buf.equals(other)))
+    report("draw clipped at the edge", measure(lambda: draw_dense(buf, 5, 10, obstacle)),
+           measure(lambda: buf.draw(6, 28, obstacle)))
+
+
+def bench_entities():
+    print("entities: list of Dots vs EntityPool, move, cull and draw 12")
+    buf = game.FrameBuffer()
+    spawns = [(random.randrange(game.SCREEN_WIDTH), random.randrange(game.SCREEN_HEIGHT))
+              for _ in range(12)]
+
+    dots = []
+    pool = game.EntityPool(16)
+
+    def lists():
+        if not dots:
+            dots.extend(game.Dot(x, y) for x, y in spawns)
+        for dot in dots:
+            dot.y -= 1
+        dots[:] = [dot for dot in dots if not dot.outside()]
+        for dot in dots:
+            buf.set(dot.x, dot.y, game.YELLOW_IDX)
+
+    def pooled():
+        if not pool.count:
+            for x, y in spawns:
+                pool.add(x, y, dy=-1)
+        pool.move()
+        pool.cull()
+        pool.draw(buf, game.YELLOW_IDX)
+
+    report("step", measure(lists), measure(pooled))
+
+
+def bench_terminal():
+    print("terminal emulator: bytes and time per frame")
+    panel = load_terminal().NeoPixel(None, game.SCREEN_SIZE)
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        for idx in range(game.SCREEN_SIZE):
+            panel[idx] = random.choice(game.COLORS)
+        full = measure(panel.write, repeat=1)
+        full_bytes = panel.bytes_last
+
+        def one_pixel():
+            panel[random.randrange(game.SCREEN_SIZE)] = random.choice(game.COLORS)
+            panel.write()
+        sparse = measure(one_pixel)
+        sparse_bytes = panel.bytes_total // panel.frames
+    finally:
+        sys.stdout = stdout
+
+    print(f"  {'first frame':<32} {full:10.1f} us {full_bytes:10} bytes")
+    print(f"  {'one pixel changed':<32} {sparse:10.1f} us {sparse_bytes:10} bytes")
+
+
+BENCHMARKS = {
+    "render": bench_render,
+    "well": bench_well,
+    "figures": bench_figures,
+    "bulk": bench_bulk,
+    "entities": bench_entities,
+    "terminal": bench_terminal,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    print(f"  {'':<32} {'before':>13} {'after':>13}")
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Record, play and check frame captures of rp2040bit-main.py
+
+    $ python3 ./capture.py record [--seed S] [--ticks N] [--replay LOG] [--game NAME] out.cap
+    $ python3 ./capture.py play [--fps F] [--start N] frames.cap
+    $ python3 ./capture.py check [--seed S] [--ticks N] [--replay LOG] [--game NAME] golden.cap
+    $ python3 ./capture.py info frames.cap
+
+Set CAPTURE = True in rp2040bit-main.py to write frames.cap on the board,
+see FrameRecorder for the format. record runs a game headless, driven by
+random input or by an input log, and check runs it again and compares every
+frame with a stored capture.
+"""
+
+import io
+import sys
+import mmap
+import time
+import zlib
+import struct
+import argparse
+
+from harness import load_terminal
+from headless import game, run_headless, RandomInputs
+from replay import replay
+
+FrameRecorder = game.FrameRecorder
+
+
+class FrameReader:
+    """
+    Random access to the frames of a capture.
+
+    Only the frame lengths are read up front, a frame is decoded from the
+    keyframe before it. data can be bytes or a memory mapped file.
+    """
+
+    def __init__(self, data):
+        magic, self.width, self.height = struct.unpack_from(FrameRecorder.HEADER, data)
+        if magic != FrameRecorder.MAGIC:
+            raise ValueError("not a frame capture")
+        self.data = memoryview(data)
+        self.size = self.width * self.height
+
+        self.offsets = []
+        self.keyframes = []
+        pos = struct.calcsize(FrameRecorder.HEADER)
+        while pos + 2 <= len(data):
+            length, = struct.unpack_from("<H", data, pos)
+            self.offsets.append(pos)
+            self.keyframes.append(bool(length & FrameRecorder.KEYFRAME))
+            pos += 2 + (length & ~FrameRecorder.KEYFRAME)
+
+        self.cells = bytearray(self.size)
+        self.current = None
+
+    @staticmethod
+    def open(path: str) -> "FrameReader":
+        with open(path, "rb") as stream:
+            return FrameReader(mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.frame(idx)
+
+    def apply(self, idx: int):
+        pos = self.offsets[idx]
+        length, = struct.unpack_from("<H", self.data, pos)
+        cells = self.cells
+        if length & FrameRecorder.KEYFRAME:
+            cells[:] = bytes(self.size)
+        cell = 0
+        for byte in self.data[pos + 2:pos + 2 + (length & ~FrameRecorder.KEYFRAME)]:
+            if byte < 0x80:
+                cell += byte + 1
+                continue
+            value = byte & 0x0F
+            for _ in range((byte >> 4 & 0x07) + 1):
+                cells[cell] ^= value
+                cell += 1
+        self.current = idx
+
+    def frame(self, idx: int) -> bytes:
+        """The cells of frame idx"""
+        if not 0 <= idx < len(self):
+            raise IndexError("frame {} of {}".format(idx, len(self)))
+        if self.current is None or not self.current < idx:
+            start = idx
+            while not self.keyframes[start]:
+                start -= 1
+        else:
+            start = self.current + 1
+            for key in range(start, idx + 1):
+                if self.keyframes[key]:
+                    start = key
+        for current in range(start, idx + 1):
+            self.apply(current)
+        return bytes(self.cells)
+
+    def hashes(self) -> list:
+        """Golden hashes, a CRC32 for every frame"""
+        return [zlib.crc32(frame) for frame in self]
+
+
+def first_difference(expected: FrameReader, actual: FrameReader):
+    """Index of the first frame that differs, None when the captures match"""
+    for idx, (want, got) in enumerate(zip(expected.hashes(), actual.hashes())):
+        if want != got:
+            return idx
+    if len(expected) != len(actual):
+        return min(len(expected), len(actual))
+    return None
+
+
+def record(args) -> FrameRecorder:
+    recorder = FrameRecorder(io.BytesIO())
+    if args.replay:
+        with open(args.replay, "rb") as stream:
+            replay(stream.read(), display=recorder.capture)
+    else:
+        game.rng.seed(args.seed)
+        run_headless(getattr(game, args.game), args.ticks, RandomInputs(args.seed), recorder.capture)
+    recorder.flush()
+    return recorder
+
+
+def show(reader: FrameReader, fps: float, start=0):
+    panel = load_terminal().NeoPixel(None, reader.size, bpp=game.BPP)
+    for idx in range(start, len(reader)):
+        for cell, color in enumerate(reader.frame(idx)):
+            offset = game.LED_OFFSETS[cell]
+            panel.buf[offset:offset + game.BPP] = game.PALETTE[color]
+        panel.write()
+        time.sleep(1 / fps)
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("command", choices=("record", "play", "check", "info"))
+    parser.add_argument("capture")
+    parser.add_argument("--game", default="Tetris")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--replay", help="drive the game by an input log instead of random input")
+    parser.add_argument("--fps", type=float, default=20)
+    parser.add_argument("--start", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        recorder = record(args)
+        with open(args.capture, "wb") as stream:
+            stream.write(recorder.stream.getvalue())
+        print(recorder.stats())
+    elif args.command == "play":
+        show(FrameReader.open(args.capture), args.fps, args.start)
+    elif args.command == "check":
+        golden = FrameReader.open(args.capture)
+        actual = FrameReader(record(args).stream.getvalue())
+        idx = first_difference(golden, actual)
+        if idx is not None:
+            print("frame {} differs ({} golden frames, {} frames)".format(idx, len(golden), len(actual)))
+            return 1
+        print("{} frames match".format(len(actual)))
+    else:
+        reader = FrameReader.open(args.capture)
+        size = len(reader.data)
+        print("{} frames {} keyframes {} bytes {} bytes/frame".format(
+            len(reader), sum(reader.keyframes), size, size // max(1, len(reader))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,9 +1,39 @@
 import random
 
+# Row length of the screen figures are drawn on
+STRIDE = 8
+
 class Figure:
     def __init__(self, data: bytearray, width: int):
         self.data = memoryview(data)
         self.width = width
+        # Occupied cells of each row as a bitmask, bit N is column N
+        self.masks = bytearray(self.height)
+        # Occupied cells only: offset from the top left corner on the screen
+        # (row * STRIDE + col), column and color
+        self.offsets = bytearray()
+        self.cols = bytearray()
+        self.colors = bytearray()
+        for row in range(self.height):
+            for col in range(width):
+                ch = data[row * width + col]
+                if ch:
+                    self.masks[row] |= 1 << col
+                    self.offsets.append(row * STRIDE + col)
+                    self.cols.append(col)
+                    self.colors.append(ch)
+        # First and last rows with an occupied cell
+        self.top = 0
+        self.bottom = self.height - 1
+        while self.top < self.bottom and not self.masks[self.top]:
+            self.top += 1
+        while self.bottom > self.top and not self.masks[self.bottom]:
+            self.bottom -= 1
+        # Row masks moved to every column, see shifts(). Built on first use.
+        self.shifted = None
+        # The figure turned clockwise. All four orientations are built on the
+        # first rotate() and linked into a ring, so rotating never allocates.
+        self.rotated = None
 
     @property
     def height(self) -> int:
@@ -12,16 +42,57 @@ class Figure:
     def get(self, x, y) -> int:
         return self.data[y * self.width + x]
 
+    def shifts(self) -> tuple:
+        """
+        Row masks of the figure moved to every column from 1 - width on,
+        None where a cell would be off the screen
+        """
+        if self.shifted is None:
+            self.shifted = tuple(self.shift(x) for x in range(1 - self.width, STRIDE))
+        return self.shifted
+
+    def shift(self, x: int):
+        masks = bytearray(self.height)
+        for row in range(self.height):
+            mask = self.masks[row]
+            if x >= 0:
+                moved = mask << x
+            else:
+                moved = mask >> -x
+                if moved << -x != mask:
+                    return None
+            if moved >= 1 << STRIDE:
+                return None
+            masks[row] = moved
+        return bytes(masks)
+
     def rotate(self) -> "Figure":
-        rotated: Figure = Figure(bytearray(self.data), self.height)
+        if self.rotated is None:
+            figure = self
+            for _ in range(3):
+                figure.rotated = figure.turn()
+                figure = figure.rotated
+            figure.rotated = self
+        return self.rotated
+
+    def turn(self) -> "Figure":
+        rotated = bytearray(len(self.data))
+        rotated_width = self.height
 
         for row_idx in range(self.height):
             for ch_idx in range(self.width):
                 new_ch_idx = self.height - 1 - row_idx
                 new_row_idx = ch_idx
                 new_ch = self.data[row_idx * self.width + ch_idx]
-                rotated.data[new_row_idx * rotated.width + new_ch_idx] = new_ch
-        return rotated
+                rotated[new_row_idx * rotated_width + new_ch_idx] = new_ch
+        return Figure(rotated, rotated_width)
+
+
+TANK = Figure(bytearray(
+    b"\0\3\3"
+    b"\1\3\0"
+    b"\0\3\3"
+), width=3)
 
 
 DIGITS = [
@@ -135,5 +206,5 @@ TETRAMINO = [
         ), width=2),
 ]
 
-def random_tetramino() -> Figure:
-    return random.choice(TETRAMINO)
+def random_tetramino(rng=random) -> Figure:
+    return rng.choice(TETRAMINO)
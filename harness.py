@@ -0,0 +1,129 @@
+"""
+Load rp2040bit-main.py on CPython without the board attached
+
+The hardware modules are replaced with silent stand-ins, so the game classes
+can be driven from tests and benchmarks without a terminal.
+"""
+
+import os
+import sys
+import time
+import importlib.util
+
+
+class NullPin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 0
+    PULL_DOWN = 1
+    IRQ_RISING = 10
+
+    def __init__(self, id, dir=OUT, mode=PULL_DOWN):
+        self.id = id
+
+    def irq(self, trigger=None, handler=None):
+        pass
+
+    def value(self):
+        return 1
+
+
+class NullADC:
+    def __init__(self, id):
+        self.id = id
+
+    def read_u16(self):
+        return 32767  # Neutral position
+
+
+class NullNeoPixel:
+    ORDER = (1, 0, 2, 3)
+
+    def __init__(self, pin, n, bpp=3):
+        self.pin = pin
+        self.n = n
+        self.bpp = bpp
+        self.buf = bytearray(n * bpp)
+        self.writes = 0
+
+    def __setitem__(self, idx, val):
+        offset = idx * self.bpp
+        for i in range(self.bpp):
+            self.buf[offset + self.ORDER[i]] = val[i]
+
+    def __getitem__(self, idx):
+        offset = idx * self.bpp
+        return tuple(self.buf[offset + self.ORDER[i]] for i in range(self.bpp))
+
+    def write(self):
+        self.writes += 1
+
+
+class NullMachine:
+    Pin = NullPin
+    ADC = NullADC
+
+
+class NullNeopixelModule:
+    NeoPixel = NullNeoPixel
+
+
+class NullMicropython:
+    @staticmethod
+    def alloc_emergency_exception_buf(size):
+        pass
+
+
+class VirtualTime:
+    """
+    Stand-in for the time module of the game: sleep_ms() advances a virtual
+    clock instead of waiting, so Clock runs the game at full CPU speed
+    """
+
+    def __init__(self):
+        self.now = 0
+        self.slept = 0
+
+    def ticks_ms(self):
+        return self.now
+
+    def ticks_us(self):
+        return int(time.time() * 1000000)
+
+    def ticks_diff(self, a, b):
+        return a - b
+
+    def ticks_add(self, a, b):
+        return a + b
+
+    def sleep_ms(self, ms):
+        self.slept += ms
+        self.now += ms
+
+
+def load_module(name: str, filename: str):
+    if name in sys.modules:
+        return sys.modules[name]
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_terminal():
+    """Import the desktop neopixel.py terminal panel, which load_game() stubs out"""
+    return load_module("neopixel_terminal", "neopixel.py")
+
+
+def load_game(name="rp2040bit_main"):
+    """Import rp2040bit-main.py with the hardware modules stubbed out"""
+    if name in sys.modules:
+        return sys.modules[name]
+
+    sys.modules['machine'] = NullMachine()
+    sys.modules['neopixel'] = NullNeopixelModule()
+    sys.modules['micropython'] = NullMicropython()
+    return load_module(name, "rp2040bit-main.py")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Run the games of rp2040bit-main.py without sleeping and without a display
+
+    $ python3 ./headless.py [--ticks N] [--seed S] [--render] [game ...]
+
+Every game is driven through Game.step() by random joystick input as fast as
+the CPU allows, and restarted when it is over. Reports ticks per second.
+"""
+
+import sys
+import time
+import random
+import argparse
+
+from harness import load_game
+
+game = load_game()
+
+
+class RandomInputs:
+    """Joystick stand-in pushing the stick and the button at random"""
+
+    def __init__(self, seed=0, press_rate=8):
+        self.random = random.Random(seed)
+        self.press_rate = press_rate
+
+    def direction(self, low, high) -> int:
+        return self.random.choice((low, 0, 0, 0, high))
+
+    def read_x(self, left=-1, right=1, no_reset=False) -> int:
+        return self.direction(left, right)
+
+    def read_y(self, up=-1, down=1, no_reset=False) -> int:
+        return self.direction(up, down)
+
+    def reset_x(self):
+        pass
+
+    def reset_y(self):
+        pass
+
+    def was_pressed(self) -> int:
+        return int(self.random.randrange(self.press_rate) == 0)
+
+    def was_pressed_x(self, debounce=200) -> int:
+        return self.direction(-1, 1) if self.random.randrange(self.press_rate) == 0 else 0
+
+    def was_pressed_y(self, debounce=200) -> int:
+        return self.direction(-1, 1) if self.random.randrange(self.press_rate) == 0 else 0
+
+    def end_tick(self):
+        pass
+
+    def planned_jobs(self):
+        return None
+
+    def ran_jobs(self, count: int):
+        pass
+
+
+class NullDisplay:
+    """Display sink that only counts frames"""
+
+    def __init__(self):
+        self.frames = 0
+
+    def __call__(self, screen):
+        self.frames += 1
+
+
+def run_headless(game_class, ticks: int, inputs, display) -> dict:
+    """Run ticks steps of game_class, starting a new game after each game over"""
+    games = 1
+    current = game_class(display=display)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        alive = current.step(inputs)
+        inputs.end_tick()
+        if not alive:
+            games += 1
+            current = game_class(display=display)
+    elapsed = time.perf_counter() - start
+    return {
+        "ticks": ticks,
+        "games": games,
+        "seconds": elapsed,
+        "ticks_per_second": ticks / elapsed if elapsed else float("inf"),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--ticks", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--render", action="store_true",
+                        help="push frames through FrameBuffer.render to a null LED strip")
+    parser.add_argument("games", nargs="*", default=[cls.__name__ for _, cls in game.GAMES])
+    args = parser.parse_args(argv)
+
+    for name in args.games:
+        game.rng.seed(args.seed)
+        display = game.FrameBuffer.render if args.render else NullDisplay()
+        result = run_headless(getattr(game, name), args.ticks, RandomInputs(args.seed), display)
+        print("{:>8}: {ticks} ticks {games} games {seconds:.2f}s {ticks_per_second:.0f} ticks/s".format(
+            name, **result))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
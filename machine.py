@@ -1,35 +1,30 @@
+import os
 import sys
-import tty
+import time
+import selectors
 import threading
 
-ch = None
+# Events each ADC consumes and the value it reads for them
+AXES = {
+    27: {"left": 65000, "right": 1},  # left-right
+    28: {"up": 1, "down": 65000},  # up-down
+}
+NEUTRAL = 32000
+# Seconds "p" holds the button down, longer than Profiler.HOLD_MS
+HOLD_SECONDS = 2.5
+
 
 class ADC():
     def __init__(self, id: int):
         self.id = id
 
     def read_u16(self) -> int:
-        global ip, ch
-        if not ch:
-            ch = ip.current_char()  
-        if self.id == 27: # left-right
-            if ch == "left":
-                ch = None
-                return 65000
-            elif ch == "right":
-                ch = None
-                return 1
-            elif ch not in ["up", "down"]:
-                ch = None
-            return 32000
-        elif self.id == 28: # up-down
-            if ch == "up":
-                ch = None
-                return 1
-            elif ch == "down":
-                ch = None
-                return 65000
-            return 32000
+        """Position for the oldest key of this axis, one key per read"""
+        values = AXES[self.id]
+        ch = ip.events.take(values)
+        if ch is None:
+            return NEUTRAL
+        return values[ch]
 
 
 class Pin():
@@ -50,54 +45,163 @@ class Pin():
         self.trigger = trigger
         ip.enter_callback = handler
 
+    def value(self) -> int:
+        # Released, the button is pulled up. "p" holds it down for a while
+        if ip.held_until:
+            if time.monotonic() < ip.held_until:
+                return 0
+            ip.held_until = 0.0
+            # Let go: the rising edge calls the IRQ handler, like on the board
+            if ip.enter_callback:
+                ip.enter_callback("enter")
+        return 1
+
+
+class EventQueue():
+    """
+    Bounded ring of (key, timestamp) events shared by the reader thread and
+    the game. take() pops the oldest event of one axis and leaves the events
+    of the other axis queued. When the ring is full the oldest event is
+    dropped and counted.
+    """
+
+    def __init__(self, size=128):
+        self.keys = [None] * size
+        self.stamps = [0.0] * size
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+        self.pushed = 0
+        self.dropped = 0
+        self.taken = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def push(self, key: str, stamp: float = None):
+        if stamp is None:
+            stamp = time.monotonic()
+        size = len(self.keys)
+        with self.lock:
+            if self.count == size:
+                self.head = (self.head + 1) % size
+                self.count -= 1
+                self.dropped += 1
+            tail = (self.head + self.count) % size
+            self.keys[tail] = key
+            self.stamps[tail] = stamp
+            self.count += 1
+            self.pushed += 1
+
+    def take(self, keys):
+        """Pop the oldest event whose key is in keys, None if there is none"""
+        size = len(self.keys)
+        with self.lock:
+            for n in range(self.count):
+                idx = (self.head + n) % size
+                key = self.keys[idx]
+                if key not in keys:
+                    continue
+                stamp = self.stamps[idx]
+                # Close the gap, events of the other axis keep their order
+                for m in range(n, self.count - 1):
+                    src = (self.head + m + 1) % size
+                    dst = (self.head + m) % size
+                    self.keys[dst] = self.keys[src]
+                    self.stamps[dst] = self.stamps[src]
+                self.count -= 1
+                break
+            else:
+                return None
+
+        latency = time.monotonic() - stamp
+        self.taken += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        return key
+
+    def stats(self) -> str:
+        average = self.latency_total / self.taken if self.taken else 0
+        return "events {} taken {} queued {} dropped {} latency ms avg {:.1f} max {:.1f}".format(
+            self.pushed, self.taken, self.count, self.dropped, average * 1000, self.latency_max * 1000)
+
 
 class InputProcessor():
+    """
+    Reads the keyboard without blocking the game: a thread waits on stdin with
+    a selector, decodes whatever bytes arrived, arrow keys included, and
+    queues the keys the ADCs read. Enter calls the button IRQ handler, "p"
+    holds the button down for HOLD_SECONDS, long enough to ask the
+    Profiler for its report.
+    """
+    SEQUENCES = {
+        b"\x1b[A": "up",
+        b"\x1b[B": "down",
+        b"\x1b[C": "right",
+        b"\x1b[D": "left",
+        b"\x1b[5~": "page-up",
+        b"\x1b[6~": "page-down",
+        b"\r": "enter",
+        b"\n": "enter",
+        b"e": "exit",
+        b"p": "hold",
+        b" ": "space",
+    }
+
     def __init__(self):
-        self.char = None
+        self.events = EventQueue()
         self.enter_callback = None
-        tty.setcbreak(sys.stdin.fileno())
-
-        x = threading.Thread(target=self.process_input, daemon=True)
-        x.start()
+        self.pending = b""
+        self.held_until = 0.0
 
-    def current_char(self):
-        ch = self.char
-        self.char = None
-        return ch
+        if sys.stdin.isatty():
+            import tty
+            tty.setcbreak(sys.stdin.fileno())
+            x = threading.Thread(target=self.process_input, daemon=True)
+            x.start()
 
     def process_input(self):
+        fd = sys.stdin.fileno()
+        selector = selectors.DefaultSelector()
+        selector.register(fd, selectors.EVENT_READ)
         while True:
-            ch = self.getchr()
-            if ch == 'enter' and self.enter_callback:
+            for _ in selector.select():
+                self.feed(os.read(fd, 64))
+
+    def waiting(self) -> bool:
+        return any(seq.startswith(self.pending) and seq != self.pending for seq in self.SEQUENCES)
+
+    def feed(self, data: bytes):
+        """Decode keys from data, a sequence may continue in the next call"""
+        stamp = time.monotonic()
+        self.pending += data
+        while self.pending:
+            for seq, key in self.SEQUENCES.items():
+                if self.pending.startswith(seq):
+                    self.pending = self.pending[len(seq):]
+                    self.key(key, stamp)
+                    break
+            else:
+                if self.waiting():
+                    return
+                self.pending = self.pending[1:]
+
+    def key(self, ch: str, stamp: float):
+        if ch == "enter":
+            if self.enter_callback:
                 self.enter_callback(ch)
-                continue
-            self.char = ch
-
-    def getchr(self):
-        ch = sys.stdin.read(1)
-        if ch == '\x1b':  # Escape key
-            ch = sys.stdin.read(2)
-            if ch == '[A':  # ]
-                return "up"
-            elif ch == '[B':  # ]
-                return "down"
-            elif ch == '[C':  # ]
-                return "right"
-            elif ch == '[D':  # ]
-                return "left"
-            elif ch == '[5':  # ]
-                ch = sys.stdin.read(1)
-                return "page-up"
-            elif ch == '[6':  # ]
-                ch = sys.stdin.read(1)
-                return "page-down"
-        elif ch == '\r' or ch == '\n':  # Enter key
-            return "enter"
-        elif ch == 'e':
-            return "exit"
-        elif ch == ' ':  # Space key
-            return "space"
-        else:
-            return ch
+            return
+        if ch == "hold":
+            self.held_until = stamp + HOLD_SECONDS
+            return
+        for values in AXES.values():
+            if ch in values:
+                self.events.push(ch, stamp)
+
+    def stats(self) -> str:
+        return self.events.stats()
 
 ip = InputProcessor()
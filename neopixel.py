@@ -1,29 +1,109 @@
 import sys
 
 class NeoPixel():
-    def __init__(self, pin, size):
+    """
+    Terminal stand-in for the LED panel.
+
+    Two LED rows share a character cell: the upper half block takes the upper
+    LED as foreground and the lower LED as background color. write() keeps
+    what is on the terminal and redraws only the cells that changed, one
+    run of neighbouring cells at a time, in a single stdout write.
+    """
+    ORDER = (1, 0, 2, 3)
+    GLYPH = "▀"
+
+    def __init__(self, pin, size, bpp=3, scale=2):
         self.pin = pin
         self.width = 8
         self.hieght = 32
-        self.content = [()]*size
+        self.bpp = bpp
+        self.buf = bytearray(size * bpp)
+        # Characters per LED
+        self.scale = scale
+        # (upper, lower) colors of every character cell on the terminal
+        self.shown = None
+        # buf as of the last write
+        self.drawn = bytearray(len(self.buf))
+
+        self.frames = 0
+        self.bytes_last = 0
+        self.bytes_total = 0
+
+    def __setitem__(self, idx, val: tuple):
+        offset = idx * self.bpp
+        for i in range(self.bpp):
+            self.buf[offset + self.ORDER[i]] = val[i]
+
+    def __getitem__(self, idx) -> tuple:
+        offset = idx * self.bpp
+        return tuple(self.buf[offset + self.ORDER[i]] for i in range(self.bpp))
+
+    def color(self, x, y) -> tuple:
+        if y % 2 == 0:
+            x = self.width - 1 - x
+        return self[y*self.width + x][:3]
 
-    def __setitem__(self, idx, val: int):
-        self.content[idx] = val
+    def cell(self, x, row) -> tuple:
+        return (self.color(x, row * 2), self.color(x, row * 2 + 1))
 
+    @staticmethod
+    def pen(cell) -> str:
+        (red, green, blue), (low_red, low_green, low_blue) = cell
+        return (f'\x1b[38;2;{red*20};{green*20};{blue*20}m'
+                f'\x1b[48;2;{low_red*20};{low_green*20};{low_blue*20}m')
 
     def write(self):
-        sys.stdout.write(f'\x1b[{self.hieght*2}F\x1b[2K')
-
-        for y in range(0, self.hieght):
-            for _ in range(0, 2):
-                for x in range(0, self.width):
-                    if y % 2 == 0:
-                        x = 7 - x
-                    color = self.content[y*self.width + x]
-                    red, green, blue = color
-                    sys.stdout.write(f'\x1b[38;2;{red*20};{green*20};{blue*20}m#\x1b[0m')
-                    sys.stdout.write(f'\x1b[38;2;{red*20};{green*20};{blue*20}m#\x1b[0m')
-                    sys.stdout.write(f'\x1b[38;2;{red*20};{green*20};{blue*20}m#\x1b[0m')
-                    sys.stdout.write(f'\x1b[38;2;{red*20};{green*20};{blue*20}m#\x1b[0m')
-                sys.stdout.write('\n')
-        sys.stdout.flush()
+        rows = self.hieght // 2
+        out = []
+        if self.shown is None:
+            # Make room for the panel, the cursor stays on the line below it
+            self.shown = [None] * (rows * self.width)
+            self.drawn[:] = bytes(b ^ 0xff for b in self.buf)
+            out.append('\n' * rows)
+
+        pen = None
+        glyph = self.GLYPH * self.scale
+        stride = 2 * self.width * self.bpp
+        for row in range(rows):
+            # Both LED rows of a character row are next to each other in buf
+            start = row * stride
+            if self.buf[start:start + stride] == self.drawn[start:start + stride]:
+                continue
+            x = 0
+            while x < self.width:
+                cell = self.cell(x, row)
+                if cell == self.shown[row * self.width + x]:
+                    x += 1
+                    continue
+
+                out.append(f'\x1b[{rows - row}A\x1b[{x * self.scale + 1}G')
+                while True:
+                    self.shown[row * self.width + x] = cell
+                    if cell != pen:
+                        out.append(self.pen(cell))
+                        pen = cell
+                    out.append(glyph)
+                    x += 1
+                    if x == self.width:
+                        break
+                    cell = self.cell(x, row)
+                    if cell == self.shown[row * self.width + x]:
+                        break
+                out.append(f'\x1b[{rows - row}B\r')
+
+        if pen is not None:
+            out.append('\x1b[0m')
+        self.drawn[:] = self.buf
+
+        data = ''.join(out)
+        if data:
+            sys.stdout.write(data)
+            sys.stdout.flush()
+
+        self.frames += 1
+        self.bytes_last = len(data.encode())
+        self.bytes_total += self.bytes_last
+
+    def stats(self) -> str:
+        average = self.bytes_total // self.frames if self.frames else 0
+        return f'frames {self.frames} bytes last {self.bytes_last} avg {average}'
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Replay an input log recorded on the board at full CPU speed
+
+    $ python3 ./replay.py [--profile] session.rec
+
+Set RECORD = True in rp2040bit-main.py to write session.rec on the board.
+The game is seeded like it was on the board and fed the recorded joystick
+values, with a virtual clock in place of ticks_ms/sleep_ms, so the session
+plays out exactly as it did, only without waiting between frames.
+"""
+
+import sys
+import time
+import argparse
+
+from harness import VirtualTime
+from headless import game, NullDisplay
+
+
+def replay(data: bytes, display=None) -> dict:
+    """Play the log in data until the game is over or the log ends"""
+    inputs = game.InputReplay(data)
+    game.rng.seed(inputs.seed)
+    game_class = game.GAMES[inputs.game][1]
+
+    real_time = game.time
+    game.time = VirtualTime()
+    start = time.perf_counter()
+    try:
+        current = game_class(display=display or NullDisplay())
+        current.clock = game.Clock(current.PERIOD_MS)
+        over = False
+        while not inputs.done():
+            if not current.step(inputs):
+                over = True
+                break
+            inputs.end_tick()
+            current.clock.tick()
+        played_ms = game.time.now
+    finally:
+        game.time = real_time
+    elapsed = time.perf_counter() - start
+
+    return {
+        "game": game_class.__name__,
+        "instance": current,
+        "ticks": inputs.ticks,
+        "over": over,
+        "played_ms": played_ms,
+        "seconds": elapsed,
+        "ticks_per_second": inputs.ticks / elapsed if elapsed else float("inf"),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--profile", action="store_true",
+                        help="split the replayed frames into phases, see Profiler")
+    parser.add_argument("log")
+    args = parser.parse_args(argv)
+
+    with open(args.log, "rb") as stream:
+        data = stream.read()
+
+    if args.profile:
+        game.profiler.enable()
+    try:
+        result = replay(data)
+    finally:
+        if args.profile:
+            game.profiler.disable()
+
+    print("{game}: {ticks} ticks, {played_ms}ms of play in {seconds:.2f}s, "
+          "{ticks_per_second:.0f} ticks/s".format(**result))
+    print("game over" if result["over"] else "log ended while playing")
+    if args.profile:
+        game.profiler.dump()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
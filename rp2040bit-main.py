@@ -1,8 +1,10 @@
 import micropython
 from machine import Pin, ADC
+import sys
+import gc
 import time
-import math
-import random
+import struct
+from array import array
 import neopixel
 import figures
 from figures import Figure
@@ -11,6 +13,12 @@ if not getattr(time, "ticks_ms", None):
     setattr(time, "ticks_ms", lambda: time.time() * 1000)
 if not getattr(time, "sleep_ms", None):
     setattr(time, "sleep_ms", lambda v: time.sleep(v/1000))
+if not getattr(time, "ticks_us", None):
+    setattr(time, "ticks_us", lambda: int(time.time() * 1000000))
+if not getattr(time, "ticks_diff", None):
+    setattr(time, "ticks_diff", lambda a, b: a - b)
+if not getattr(time, "ticks_add", None):
+    setattr(time, "ticks_add", lambda a, b: a + b)
 
 #  Coordinates
 #        x
@@ -30,6 +38,8 @@ if not getattr(time, "sleep_ms", None):
 SCREEN_WIDTH = 8
 SCREEN_HEIGHT = 32
 SCREEN_SIZE = SCREEN_WIDTH * SCREEN_HEIGHT
+# Rows at the top of the screen used for score and status
+HUD_HEIGHT = 6
 
 PIXEL_WIDTH = 3
 PIXEL_MASK = 0b_111
@@ -64,13 +74,82 @@ YELLOW_IDX = 7
 DARK_GREEN_IDX = 8
 LIGHT_GREEN_IDX = 9
 
+class XorShift():
+    """
+    The part of the random module the games use, on a 16 bit xorshift.
 
+    MicroPython and CPython generate different numbers from the same seed,
+    this gives the same sequence on both so recorded sessions replay the
+    same way on a desktop. The state stays a small int, so no allocations.
+    """
+
+    def __init__(self, seed=1):
+        self.seed(seed)
+
+    def seed(self, seed: int):
+        self.state = (seed & 0xFFFF) or 1
+
+    def next(self) -> int:
+        x = self.state
+        x ^= (x << 7) & 0xFFFF
+        x ^= x >> 9
+        x ^= (x << 8) & 0xFFFF
+        self.state = x
+        return x
+
+    def randrange(self, start: int, stop=None) -> int:
+        if stop is None:
+            start, stop = 0, start
+        return start + self.next() % (stop - start)
+
+    def choice(self, seq):
+        return seq[self.randrange(len(seq))]
+
+rng = XorShift()
+
+
+# Bytes per LED and the position of each color component on the wire
+# (the WS2812 wants GRB).
+BPP = getattr(np, "bpp", 3)
+ORDER = getattr(np, "ORDER", (1, 0, 2, 3))
+
+
+def wire_color(color: tuple) -> bytes:
+    wire = bytearray(BPP)
+    for i in range(BPP):
+        wire[ORDER[i]] = color[i] if i < len(color) else 0
+    return bytes(wire)
+
+# COLORS converted to the NeoPixel byte order
+PALETTE = tuple(wire_color(color) for color in COLORS)
+
+
+def led_offset(idx: int) -> int:
+    # Even rows of the panel are wired right to left
+    x = idx % SCREEN_WIDTH
+    y = idx // SCREEN_WIDTH
+    if y % 2 == 0:
+        x = SCREEN_WIDTH - 1 - x
+    return (SCREEN_WIDTH * y + x) * BPP
+
+# FrameBuffer index -> offset of the pixel in the NeoPixel byte buffer
+LED_OFFSETS = tuple(led_offset(idx) for idx in range(SCREEN_SIZE))
 
 micropython.alloc_emergency_exception_buf(100)
 
 HLINE = Figure(bytearray(b"\6" * SCREEN_WIDTH), SCREEN_WIDTH)
 
+# Source for clearing buffers with a single slice assignment
+ZEROS = memoryview(bytes(SCREEN_SIZE))
+
 class FrameBuffer():
+    # Colors currently shown by the LEDs. Shared by all buffers since they all
+    # render to the same strip; 0xFF never matches a color so the first
+    # render pushes every pixel.
+    pushed = bytearray(b"\xff" * SCREEN_SIZE)
+    pixels_changed = 0
+    writes_skipped = 0
+
     def __init__(self, content = None):
         self.content = content
         if not self.content:
@@ -89,15 +168,49 @@ class FrameBuffer():
         return buf
 
     def render(self):
-        for x in range(SCREEN_WIDTH):
-            for y in range(SCREEN_HEIGHT):
-                color = self.get(x, y)
-                set_pixel(x, y, color)
+        pushed = FrameBuffer.pushed
+        if self.content == pushed:
+            FrameBuffer.writes_skipped += 1
+            return
+
+        content = self.content
+        buf = np.buf
+        changed = 0
+        for idx in range(SCREEN_SIZE):
+            color = content[idx]
+            if color != pushed[idx]:
+                pushed[idx] = color
+                offset = LED_OFFSETS[idx]
+                buf[offset:offset + BPP] = PALETTE[color]
+                changed += 1
+        FrameBuffer.pixels_changed += changed
         np.write()
 
+    @staticmethod
+    def invalidate():
+        """Forget what the LEDs show, so the next render pushes every pixel"""
+        FrameBuffer.pushed[:] = b"\xff" * SCREEN_SIZE
+
     def clear(self, _from=0, to=SCREEN_SIZE):
-        for idx in range(_from, to):
-            self.content[idx] = 0
+        self.content[_from:to] = ZEROS[_from:to]
+
+    def fill(self, x: int, y: int, width: int, height: int, color: int):
+        """Fill the rectangle, clipped to the screen, with one color"""
+        x0 = max(0, x)
+        x1 = min(SCREEN_WIDTH, x + width)
+        y0 = max(0, y)
+        y1 = min(SCREEN_HEIGHT, y + height)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        content = self.content
+        length = x1 - x0
+        start = y0 * SCREEN_WIDTH + x0
+        for idx in range(start, start + length):
+            content[idx] = color
+        for row in range(y0 + 1, y1):
+            idx = row * SCREEN_WIDTH + x0
+            content[idx:idx + length] = content[start:start + length]
 
     def set(self, x, y, color):
         idx = y * SCREEN_WIDTH + x
@@ -106,13 +219,23 @@ class FrameBuffer():
     def get(self, x, y) -> int:
         return self.content[y * SCREEN_WIDTH + x]
 
-    def shift_right(self, count=1):
-        self.content[count*SCREEN_WIDTH:] = self.content[:SCREEN_SIZE-count*SCREEN_WIDTH]
-        self.clear(to=count)
+    def scroll(self, count=1):
+        """Move the content count rows down (up if negative) and clear the rows left behind"""
+        count = max(-SCREEN_HEIGHT, min(SCREEN_HEIGHT, count))
+        shift = abs(count) * SCREEN_WIDTH
+        if count >= 0:
+            self.content[shift:] = self.content[:SCREEN_SIZE-shift]
+            self.clear(to=shift)
+        else:
+            self.content[:SCREEN_SIZE-shift] = self.content[shift:]
+            self.clear(_from=SCREEN_SIZE-shift)
 
     def copy_from(self: memoryview, _from: memoryview):
         self.content[:] = _from.content[:]
 
+    def equals(self, other: "FrameBuffer", _from=0, to=SCREEN_SIZE) -> bool:
+        return self.content[_from:to] == other.content[_from:to]
+
     def view(self, _from: int, to: int) -> memoryview:
         return self.content[_from:to]
 
@@ -125,80 +248,330 @@ class FrameBuffer():
         return self.content[row*SCREEN_WIDTH:(row+1)*SCREEN_WIDTH]
 
     def collides(self, x: int, y: int, figure: Figure):
-        for row in range(figure.height):
-            for col in range(figure.width):
-                ch = figure.get(col, row)
-                if ch and not self.available(x + col, y + row):
-                    return True
+        content = self.content
+        offsets = figure.offsets
+        cols = figure.cols
+        base = y * SCREEN_WIDTH + x
+        for cell in range(len(offsets)):
+            idx = base + offsets[cell]
+            if (not -1 < x + cols[cell] < SCREEN_WIDTH
+                or not -1 < idx < SCREEN_SIZE or content[idx] != BLACK_IDX):
+                return True
         return False
 
     def draw(self, x: int, y: int, figure: Figure, color=None):
-        for row in range(figure.height):
-            for col in range(figure.width):
-                ch = figure.get(col, row)
-                if ch:
-                    self.set(x + col, y + row, ch if color is None else color)
+        content = self.content
+        offsets = figure.offsets
+        colors = figure.colors
+        base = y * SCREEN_WIDTH + x
+        if (0 <= x and x + figure.width <= SCREEN_WIDTH
+            and 0 <= y and y + figure.height <= SCREEN_HEIGHT):
+            for cell in range(len(offsets)):
+                content[base + offsets[cell]] = colors[cell] if color is None else color
+            return
 
+        # Partly off screen: keep only cells inside the visible columns and rows
+        cols = figure.cols
+        min_col = -x
+        max_col = SCREEN_WIDTH - x
+        for cell in range(len(offsets)):
+            idx = base + offsets[cell]
+            if min_col <= cols[cell] < max_col and -1 < idx < SCREEN_SIZE:
+                content[idx] = colors[cell] if color is None else color
+
+
+class Layers():
+    """
+    Static layers composed into a cached base with sprites drawn on top.
+
+    The static layers (upper non-zero pixels win) are merged again only in
+    the rows invalidate() marks. The layers above the first are kept merged
+    in top with the rows they light up, so a change of the first layer
+    alone copies its rows and overlays just the lit rows of top. Sprites
+    drawn through draw()/set() mark their rows, and begin() puts just those
+    rows back from the base for the next frame.
+    """
+    ONES = memoryview(b"\1" * SCREEN_HEIGHT)
+
+    def __init__(self, screen: FrameBuffer, *layers: FrameBuffer):
+        self.screen = screen
+        self.layers = layers
+        self.base = FrameBuffer()
+        self.top = FrameBuffer()
+        # Rows of top with a lit pixel
+        self.covered = bytearray(SCREEN_HEIGHT)
+        # Rows of base, and of top, to compose again
+        self.stale = bytearray(b"\1" * SCREEN_HEIGHT)
+        self.stale_top = bytearray(b"\1" * SCREEN_HEIGHT)
+        # Rows the upper layers may light up or are stale in
+        self.upper_first = 0
+        self.upper_last = SCREEN_HEIGHT
+        self.changed = True
+        self.dirty = bytearray(SCREEN_HEIGHT)
+        self.composed = 0
+        self.top_merged = 0
+
+    def invalidate(self, layer: FrameBuffer = None, y=0, height=SCREEN_HEIGHT):
+        """Mark rows of layer, of every layer when it is None, as changed"""
+        first = max(0, y)
+        last = min(SCREEN_HEIGHT, y + height)
+        if first >= last:
+            return
+        self.stale[first:last] = Layers.ONES[first:last]
+        if layer is None or layer is not self.layers[0]:
+            self.stale_top[first:last] = Layers.ONES[first:last]
+            self.upper_first = min(self.upper_first, first)
+            self.upper_last = max(self.upper_last, last)
+        self.changed = True
+
+    def merge_top(self, row: int):
+        """Merge row of the layers above the first into top"""
+        start = row * SCREEN_WIDTH
+        end = start + SCREEN_WIDTH
+        top = self.top.content
+        top[start:end] = ZEROS[start:end]
+        covered = 0
+        for layer in self.layers[1:]:
+            content = layer.content
+            if content[start:end] == ZEROS[start:end]:
+                continue
+            for idx in range(start, end):
+                color = content[idx]
+                if color:
+                    top[idx] = color
+            covered = 1
+        self.covered[row] = covered
+        self.stale_top[row] = 0
+        self.top_merged += 1
+
+    def compose(self):
+        base = self.base.content
+        top = self.top.content
+        bottom = self.layers[0].content if self.layers else ZEROS
+        stale = self.stale
+        stale_top = self.stale_top
+        covered = self.covered
+        merged = self.top_merged
+        row = 0
+        while row < SCREEN_HEIGHT:
+            if not stale[row]:
+                row += 1
+                continue
+            first = row
+            while row < SCREEN_HEIGHT and stale[row]:
+                stale[row] = 0
+                row += 1
+            # An index loop, a slice of a memoryview is a new object
+            for idx in range(first * SCREEN_WIDTH, row * SCREEN_WIDTH):
+                base[idx] = bottom[idx]
+            for line in range(max(first, self.upper_first), min(row, self.upper_last)):
+                if stale_top[line]:
+                    self.merge_top(line)
+                if not covered[line]:
+                    continue
+                for idx in range(line * SCREEN_WIDTH, (line + 1) * SCREEN_WIDTH):
+                    color = top[idx]
+                    if color:
+                        base[idx] = color
+
+        if merged != self.top_merged:
+            # Only the lit rows of top matter until an upper layer changes
+            self.upper_first = SCREEN_HEIGHT
+            self.upper_last = 0
+            for line in range(SCREEN_HEIGHT):
+                if covered[line]:
+                    self.upper_first = min(self.upper_first, line)
+                    self.upper_last = line + 1
+        self.changed = False
+        self.composed += 1
+
+    def begin(self):
+        """Reset the screen to the static layers before drawing sprites"""
+        dirty = self.dirty
+        if self.changed:
+            self.compose()
+            self.screen.copy_from(self.base)
+            for row in range(SCREEN_HEIGHT):
+                dirty[row] = 0
+            return
 
-def is_full(m: memoryview):
-    return all(b != 0 for b in m)
+        screen = self.screen.content
+        base = self.base.content
+        row = 0
+        while row < SCREEN_HEIGHT:
+            if not dirty[row]:
+                row += 1
+                continue
+            start = row
+            while row < SCREEN_HEIGHT and dirty[row]:
+                dirty[row] = 0
+                row += 1
+            for idx in range(start * SCREEN_WIDTH, row * SCREEN_WIDTH):
+                screen[idx] = base[idx]
+
+    def overlay(self, layer: FrameBuffer, y=0, height=SCREEN_HEIGHT):
+        """Draw the lit pixels of layer again over the sprites in rows"""
+        screen = self.screen.content
+        content = layer.content
+        dirty = self.dirty
+        for row in range(max(0, y), min(SCREEN_HEIGHT, y + height)):
+            # The other rows show the base, which has layer on top already
+            if not dirty[row]:
+                continue
+            for idx in range(row * SCREEN_WIDTH, (row + 1) * SCREEN_WIDTH):
+                color = content[idx]
+                if color:
+                    screen[idx] = color
 
+    def touch(self, y: int, height: int):
+        for row in range(max(0, y), min(SCREEN_HEIGHT, y + height)):
+            self.dirty[row] = 1
 
-def is_empty(m: memoryview):
-    return all(b == 0 for b in m)
+    def draw(self, x: int, y: int, figure: Figure, color=None):
+        self.screen.draw(x, y, figure, color)
+        self.touch(y, figure.height)
 
+    def set(self, x: int, y: int, color: int):
+        self.screen.set(x, y, color)
+        self.touch(y, 1)
 
-def set_pixel(x: int, y: int, color: int):
-    if y % 2 == 0:
-        x = 7 - x
-    np[SCREEN_WIDTH * y + x] = COLORS[color]
 
+class Bitboard():
+    """Cell occupancy of the screen, one byte per row and bit N is column N"""
+    FULL = (1 << SCREEN_WIDTH) - 1
+
+    def __init__(self):
+        self.rows = bytearray(SCREEN_HEIGHT)
+
+    def collides(self, x: int, y: int, figure: Figure) -> bool:
+        # Masks already at column x, so every row is a single AND
+        shifted = figure.shifted or figure.shifts()
+        idx = x + figure.width - 1
+        if not -1 < idx < len(shifted):
+            return True
+        masks = shifted[idx]
+        top = y + figure.top
+        bottom = y + figure.bottom
+        if masks is None or top < 0 or bottom >= SCREEN_HEIGHT:
+            return True
+        rows = self.rows
+        for row in range(top, bottom + 1):
+            if rows[row] & masks[row - y]:
+                return True
+        return False
+
+    def place(self, x: int, y: int, figure: Figure):
+        rows = self.rows
+        masks = figure.masks
+        for row in range(len(masks)):
+            if -1 < y + row < SCREEN_HEIGHT:
+                rows[y + row] |= (masks[row] << x if x >= 0 else masks[row] >> -x) & Bitboard.FULL
+
+    def is_full(self, row: int) -> bool:
+        return self.rows[row] == Bitboard.FULL
+
+    def is_empty(self, row: int) -> bool:
+        return not self.rows[row]
+
+    def clear(self, _from=0, to=SCREEN_HEIGHT):
+        self.rows[_from:to] = ZEROS[_from:to]
 
 
 class Joystick():
+    """
+    The stick is sampled once per frame: the first read after end_tick()
+    reads both ADCs and the time, and every read of the frame maps that
+    snapshot. Mapping is integer only, through the thresholds of levels().
+    """
+    CENTER = 32767
+    # Offsets from CENTER where each level starts, by magnitude
+    THRESHOLDS = {}
+
     def __init__(self, debounce_press=200):
         self.button = Pin(16, Pin.IN, Pin.PULL_UP)
         self.button.irq(trigger=Pin.IRQ_RISING, handler=lambda _: self.button_callback())
         self.debounce_press = debounce_press
         self.__pressed = 0
         self.__debounce_time = 0
+        self.__cancelled = False
+
+        self.sampled = False
+        self.now = 0
 
         self.x_adc = ADC(27)
+        self.x_raw = Joystick.CENTER
         self.x = 0
         self.__debounce_time_x = 0
 
         self.y_adc = ADC(28)
+        self.y_raw = Joystick.CENTER
         self.y = 0
         self.__debounce_time_y = 0
 
+    def sample(self):
+        if self.sampled:
+            return
+        self.sampled = True
+        self.now = time.ticks_ms()
+        self.x_raw = self.x_adc.read_u16()
+        self.y_raw = self.y_adc.read_u16()
+
     def was_pressed(self):
         pressed = self.__pressed
         self.__pressed = 0
         return pressed
 
     def button_callback(self):
-        if (time.ticks_ms() - self.__debounce_time) > self.debounce_press:
-            self.__pressed = 1
+        if time.ticks_diff(time.ticks_ms(), self.__debounce_time) > self.debounce_press:
             self.__debounce_time = time.ticks_ms()
+            if self.__cancelled:
+                self.__cancelled = False
+                return
+            self.__pressed = 1
+
+    def cancel_press(self):
+        """Drop the pending press and the one the held button gives on release"""
+        self.__pressed = 0
+        self.__cancelled = True
+
+    @staticmethod
+    def levels(magnitude: int) -> array:
+        """
+        Thresholds for round(offset * magnitude / 32768): level k starts at
+        32768 * (k - 1/2) / magnitude, a tie rounds to the even level.
+        """
+        table = Joystick.THRESHOLDS.get(magnitude)
+        if table is None:
+            table = array("I")
+            for level in range(1, magnitude + 1):
+                edge = 32768 * (2 * level - 1)
+                threshold = (edge + 2 * magnitude - 1) // (2 * magnitude)
+                if edge % (2 * magnitude) == 0 and level % 2:
+                    threshold += 1
+                table.append(threshold)
+            Joystick.THRESHOLDS[magnitude] = table
+        return table
 
     def map_direction(self, analog_val: int, min: int, max: int) -> int:
-        _max = -abs(max)
-        _min = abs(min)
-
-        val = analog_val - 32767
-        if val < 0: 
-            # The max mapping corresponds to the smaller half (it's a bit unusual, but correct)
-            if _max != 0:
-                val = round(val / ( 32768 / _max ))
-                return int(math.copysign(1, max) * val)
-        elif _min != 0:
-                val = round(val / ( 32768 / _min ))
-                return int(math.copysign(1, min) * val)
-        return 0
+        val = analog_val - Joystick.CENTER
+        # The max mapping corresponds to the smaller half (it's a bit unusual, but correct)
+        scale = max if val < 0 else min
+        if not scale:
+            return 0
+        if val < 0:
+            val = -val
+
+        level = 0
+        for threshold in Joystick.levels(scale if scale > 0 else -scale):
+            if val < threshold:
+                break
+            level += 1
+        return level if scale > 0 else -level
 
     def read_x(self, left=-1, right=1, no_reset=False):
         if not self.x or not no_reset:
-            self.x = self.map_direction(self.x_adc.read_u16(), left, right)
+            self.sample()
+            self.x = self.map_direction(self.x_raw, left, right)
         return self.x
 
     def reset_x(self):
@@ -206,16 +579,19 @@ class Joystick():
 
     def was_pressed_x(self, debounce=200):
         pressed = 0
+        # Sampled even with a direction latched, so self.now moves on
+        self.sample()
         self.read_x(no_reset=True)
-        if (time.ticks_ms() - self.__debounce_time_x) > debounce:
+        if time.ticks_diff(self.now, self.__debounce_time_x) > debounce:
             pressed = self.x
             self.x = 0
-            self.__debounce_time_x = time.ticks_ms()
+            self.__debounce_time_x = self.now
         return pressed
 
     def read_y(self, up=-1, down=1, no_reset=False):
         if not self.y or not no_reset:
-            self.y = self.map_direction(self.y_adc.read_u16(), down, up)
+            self.sample()
+            self.y = self.map_direction(self.y_raw, down, up)
         return self.y
 
     def reset_y(self):
@@ -223,17 +599,773 @@ class Joystick():
 
     def was_pressed_y(self, debounce=200):
         pressed = 0
+        # Sampled even with a direction latched, so self.now moves on
+        self.sample()
         self.read_y(no_reset=True)
-        if (time.ticks_ms() - self.__debounce_time_y) > debounce:
+        if time.ticks_diff(self.now, self.__debounce_time_y) > debounce:
             pressed = self.y
             self.y = 0
-            self.__debounce_time_y = time.ticks_ms()
+            self.__debounce_time_y = self.now
         return pressed
 
+    def end_tick(self):
+        """Called by the game loop after every tick, the next read samples again"""
+        self.sampled = False
+
+    def planned_jobs(self):
+        """Jobs Scheduler.run must run this frame, None leaves it to the budget"""
+        return None
+
+    def ran_jobs(self, count: int):
+        pass
+
 joy = Joystick()
 
-class Tetris():
+
+class InputRecorder():
+    """
+    Joystick wrapper logging every value a game reads, to replay the session.
+
+    The log starts with a header: MAGIC, the index of the game in GAMES and
+    the rng seed. Then one byte per read: the method number in the top 3
+    bits and the value as a 5 bit signed integer, and END_TICK after every
+    tick. The AI jobs Scheduler.run ran in a frame are logged as well, in
+    parts of up to JOBS_PART, a part smaller than that ends the count: the
+    budget is wall-clock time, which a replay can't reproduce. Bytes are
+    buffered to keep flash writes few and large.
+    """
+    MAGIC = b"PTI2"
+    HEADER = "<4sBI"
+    METHODS = ("read_x", "read_y", "was_pressed", "was_pressed_x", "was_pressed_y", "ran_jobs")
+    END_TICK = 0xFF
+    JOBS_PART = 15
+
+    def __init__(self, source, stream, game: int, seed: int, size=256):
+        self.source = source
+        self.stream = stream
+        self.buf = bytearray(size)
+        self.used = 0
+        self.ticks = 0
+        stream.write(struct.pack(InputRecorder.HEADER, InputRecorder.MAGIC, game, seed))
+
+    def log(self, method: int, value: int) -> int:
+        if self.used == len(self.buf):
+            self.flush()
+        self.buf[self.used] = method << 5 | (value & 0x1F)
+        self.used += 1
+        return value
+
+    def read_x(self, left=-1, right=1, no_reset=False):
+        return self.log(0, self.source.read_x(left, right, no_reset))
+
+    def read_y(self, up=-1, down=1, no_reset=False):
+        return self.log(1, self.source.read_y(up, down, no_reset))
+
+    def was_pressed(self):
+        return self.log(2, self.source.was_pressed())
+
+    def was_pressed_x(self, debounce=200):
+        return self.log(3, self.source.was_pressed_x(debounce))
+
+    def was_pressed_y(self, debounce=200):
+        return self.log(4, self.source.was_pressed_y(debounce))
+
+    def reset_x(self):
+        self.source.reset_x()
+
+    def reset_y(self):
+        self.source.reset_y()
+
+    def end_tick(self):
+        self.source.end_tick()
+        self.log(7, -1)
+        self.ticks += 1
+
+    def planned_jobs(self):
+        return self.source.planned_jobs()
+
+    def ran_jobs(self, count: int):
+        self.source.ran_jobs(count)
+        while count >= InputRecorder.JOBS_PART:
+            self.log(5, InputRecorder.JOBS_PART)
+            count -= InputRecorder.JOBS_PART
+        self.log(5, count)
+
+    def flush(self):
+        self.stream.write(memoryview(self.buf)[:self.used])
+        self.used = 0
+
+    def close(self):
+        self.flush()
+
+
+class InputReplay():
+    """Input source playing back a log written by InputRecorder"""
+
+    def __init__(self, data: bytes):
+        magic, self.game, self.seed = struct.unpack_from(InputRecorder.HEADER, data)
+        if magic != InputRecorder.MAGIC:
+            raise ValueError("not an input log")
+        self.data = memoryview(data)
+        self.pos = struct.calcsize(InputRecorder.HEADER)
+        self.ticks = 0
+        self.jobs = None
+
+    def done(self) -> bool:
+        return self.pos >= len(self.data)
+
+    def take(self, method: int) -> int:
+        if self.done():
+            raise EOFError("input log ends after {} ticks".format(self.ticks))
+        byte = self.data[self.pos]
+        if byte >> 5 != method:
+            raise ValueError("replay diverged at tick {}: read {} but the log has {}".format(
+                self.ticks, method, byte >> 5))
+        self.pos += 1
+        value = byte & 0x1F
+        return value - 32 if value & 0x10 else value
+
+    def read_x(self, left=-1, right=1, no_reset=False):
+        return self.take(0)
+
+    def read_y(self, up=-1, down=1, no_reset=False):
+        return self.take(1)
+
+    def was_pressed(self):
+        return self.take(2)
+
+    def was_pressed_x(self, debounce=200):
+        return self.take(3)
+
+    def was_pressed_y(self, debounce=200):
+        return self.take(4)
+
+    def reset_x(self):
+        pass
+
+    def reset_y(self):
+        pass
+
+    def end_tick(self):
+        self.take(7)
+        self.ticks += 1
+
+    def planned_jobs(self) -> int:
+        count = 0
+        while True:
+            part = self.take(5)
+            count += part
+            if part < InputRecorder.JOBS_PART:
+                break
+        self.jobs = count
+        return count
+
+    def ran_jobs(self, count: int):
+        if count != self.jobs:
+            raise ValueError("replay diverged at tick {}: ran {} AI jobs but the log has {}".format(
+                self.ticks, count, self.jobs))
+
+
+# Bytes allocated on the heap, only MicroPython has it
+mem_alloc = getattr(gc, "mem_alloc", None)
+
+
+class Clock():
+    """
+    Drives a game loop at a fixed frame period.
+
+    tick() sleeps only for what is left of the period after the frame's own
+    work. When a frame overruns, the next ticks don't sleep until the loop
+    has caught up, so game logic keeps its rate, and should_render() skips
+    rendering while the loop is a whole frame or more behind.
+
+    On MicroPython tick() also counts the heap bytes each frame allocated,
+    a steady state game loop should allocate none.
+    """
+    # Render at least every MAX_SKIP frames, and give up catching up when
+    # this many frames behind
+    MAX_SKIP = 4
+
+    def __init__(self, period_ms: int):
+        self.period = period_ms
+        self.started = time.ticks_ms()
+        self.deadline = time.ticks_add(self.started, period_ms)
+        self.skipped = 0
+        self.behind = False
+
+        self.frames = 0
+        self.total_ms = 0
+        self.max_ms = 0
+        self.overruns = 0
+        self.renders_skipped = 0
+
+        self.allocated = mem_alloc() if mem_alloc else 0
+        self.alloc_last = 0
+        self.alloc_max = 0
+        self.alloc_frames = 0
+        self.collections = 0
+
+    def should_render(self) -> bool:
+        if self.behind and self.skipped < Clock.MAX_SKIP:
+            self.skipped += 1
+            self.renders_skipped += 1
+            return False
+        self.skipped = 0
+        return True
+
+    def tick(self):
+        if mem_alloc:
+            self.count_alloc(mem_alloc())
+        now = time.ticks_ms()
+        spent = time.ticks_diff(now, self.started)
+        self.frames += 1
+        self.total_ms += spent
+        self.max_ms = max(self.max_ms, spent)
+
+        left = time.ticks_diff(self.deadline, now)
+        if left > 0:
+            time.sleep_ms(left)
+            self.behind = False
+        else:
+            if spent > self.period:
+                self.overruns += 1
+            self.behind = -left >= self.period
+            if -left >= Clock.MAX_SKIP * self.period:
+                self.deadline = now
+        self.deadline = time.ticks_add(self.deadline, self.period)
+        self.started = time.ticks_ms()
+
+    def count_alloc(self, allocated: int):
+        delta = allocated - self.allocated
+        self.allocated = allocated
+        if delta < 0:
+            # The collector ran during the frame, what it allocated is unknown
+            self.collections += 1
+            return
+        self.alloc_last = delta
+        self.alloc_max = max(self.alloc_max, delta)
+        if delta:
+            self.alloc_frames += 1
+
+    def average_ms(self) -> float:
+        return self.total_ms / self.frames if self.frames else 0
+
+    def stats(self) -> str:
+        return ("frames {} avg {:.1f}ms max {}ms overruns {} skipped renders {} "
+                "alloc last {}B max {}B frames {} gc {}").format(
+            self.frames, self.average_ms(), self.max_ms, self.overruns, self.renders_skipped,
+            self.alloc_last, self.alloc_max, self.alloc_frames, self.collections)
+
+
+# Set to True to profile frames, see Profiler
+PROFILE = False
+
+
+class Profiler():
+    """
+    Splits the time of every frame between input, update, compose, output
+    and idle (sleeping in Clock.tick).
+
+    enable() wraps the methods of each phase with timers, so nothing is
+    measured, nor slowed down, unless profiling is on. Time outside of any
+    wrapped method is game logic and counts as update. Per-frame totals go
+    into a preallocated ring of the last SAMPLES frames.
+
+    The report is printed on a button press held for HOLD_MS, or when "p"
+    arrives on the serial console. On the desktop machine.py, "p" holds the
+    button down.
+    """
+    INPUT = 0
+    UPDATE = 1
+    COMPOSE = 2
+    OUTPUT = 3
+    IDLE = 4
+    PHASES = ("input", "update", "compose", "output", "idle")
+    SAMPLES = 64
+    HOLD_MS = 2000
+
     def __init__(self):
+        self.enabled = False
+        self.samples = array("l", [0] * (len(Profiler.PHASES) * Profiler.SAMPLES))
+        self.frame = array("l", [0] * len(Profiler.PHASES))
+        self.head = 0
+        self.count = 0
+
+        self.stack = bytearray(16)
+        self.stack[0] = Profiler.UPDATE
+        self.depth = 0
+        self.since = 0
+
+        self.held_since = None
+        self.serial = None
+        self.wrapped = []
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.since = time.ticks_us()
+
+        for name in ("read_x", "read_y", "was_pressed", "was_pressed_x", "was_pressed_y"):
+            self.instrument(Joystick, name, Profiler.INPUT)
+        for name in ("draw", "copy_from", "clear", "fill", "scroll"):
+            self.instrument(FrameBuffer, name, Profiler.COMPOSE)
+        for name in ("begin", "draw", "set"):
+            self.instrument(Layers, name, Profiler.COMPOSE)
+        self.instrument(Scheduler, "run", Profiler.UPDATE)
+        self.instrument(Live, "next_generation", Profiler.UPDATE)
+        # With a render worker this times handing the frame over, the LEDs
+        # are written from the worker's thread, which keeps its own time
+        self.instrument(FrameBuffer, "render", Profiler.OUTPUT)
+        if not renderer.running:
+            self.instrument(np, "write", Profiler.OUTPUT)
+        self.instrument(Clock, "tick", Profiler.IDLE, frame=True)
+
+        try:
+            import select
+            if sys.implementation.name == "micropython":
+                self.serial = select.poll()
+                self.serial.register(sys.stdin, select.POLLIN)
+        except (ImportError, AttributeError):
+            self.serial = None
+
+    def disable(self):
+        """Put the original methods back"""
+        for owner, name, method in reversed(self.wrapped):
+            setattr(owner, name, method)
+        self.wrapped = []
+        self.serial = None
+        self.enabled = False
+
+    def instrument(self, owner, name: str, phase: int, frame=False):
+        method = getattr(owner, name)
+        self.wrapped.append((owner, name, method))
+        # np is an instance, its method comes bound
+        bound = not isinstance(owner, type)
+        setattr(owner, name, self.timer(name, method, phase, frame, bound))
+
+    def timer(self, name: str, method, phase: int, frame: bool, bound: bool):
+        """
+        method wrapped with timers, with the signature of method. A wrapper
+        taking *args and **kwargs would allocate a tuple and a dict on every
+        call on MicroPython, so each signature enable() wraps has its own.
+        """
+        enter = self.enter
+        leave = self.leave_frame if frame else self.leave
+
+        if bound:
+            def timed():
+                enter(phase)
+                try:
+                    return method()
+                finally:
+                    leave()
+        elif name == "read_x":
+            def timed(obj, left=-1, right=1, no_reset=False):
+                enter(phase)
+                try:
+                    return method(obj, left, right, no_reset)
+                finally:
+                    leave()
+        elif name == "read_y":
+            def timed(obj, up=-1, down=1, no_reset=False):
+                enter(phase)
+                try:
+                    return method(obj, up, down, no_reset)
+                finally:
+                    leave()
+        elif name in ("was_pressed_x", "was_pressed_y"):
+            def timed(obj, debounce=200):
+                enter(phase)
+                try:
+                    return method(obj, debounce)
+                finally:
+                    leave()
+        elif name == "draw":
+            def timed(obj, x, y, figure, color=None):
+                enter(phase)
+                try:
+                    return method(obj, x, y, figure, color)
+                finally:
+                    leave()
+        elif name == "set":
+            def timed(obj, x, y, color):
+                enter(phase)
+                try:
+                    return method(obj, x, y, color)
+                finally:
+                    leave()
+        elif name == "clear":
+            def timed(obj, _from=0, to=SCREEN_SIZE):
+                enter(phase)
+                try:
+                    return method(obj, _from, to)
+                finally:
+                    leave()
+        elif name == "fill":
+            def timed(obj, x, y, width, height, color):
+                enter(phase)
+                try:
+                    return method(obj, x, y, width, height, color)
+                finally:
+                    leave()
+        elif name == "scroll":
+            def timed(obj, count=1):
+                enter(phase)
+                try:
+                    return method(obj, count)
+                finally:
+                    leave()
+        elif name == "run":
+            def timed(obj, inputs):
+                enter(phase)
+                try:
+                    return method(obj, inputs)
+                finally:
+                    leave()
+        elif name == "copy_from":
+            def timed(obj, _from):
+                enter(phase)
+                try:
+                    return method(obj, _from)
+                finally:
+                    leave()
+        else:
+            def timed(obj):
+                enter(phase)
+                try:
+                    return method(obj)
+                finally:
+                    leave()
+        return timed
+
+    def enter(self, phase: int):
+        now = time.ticks_us()
+        self.frame[self.stack[self.depth]] += time.ticks_diff(now, self.since)
+        self.since = now
+        if self.depth < len(self.stack) - 1:
+            self.depth += 1
+        self.stack[self.depth] = phase
+
+    def leave(self):
+        now = time.ticks_us()
+        self.frame[self.stack[self.depth]] += time.ticks_diff(now, self.since)
+        self.since = now
+        if self.depth > 0:
+            self.depth -= 1
+
+    def leave_frame(self):
+        self.leave()
+        self.end_frame()
+
+    def end_frame(self):
+        samples = self.samples
+        frame = self.frame
+        for phase in range(len(frame)):
+            samples[phase * Profiler.SAMPLES + self.head] = frame[phase]
+            frame[phase] = 0
+        self.head = (self.head + 1) % Profiler.SAMPLES
+        self.count = min(self.count + 1, Profiler.SAMPLES)
+
+        if self.requested():
+            self.dump()
+
+    def requested(self) -> bool:
+        if self.serial and self.serial.poll(0):
+            return sys.stdin.read(1) == "p"
+
+        # The button pulls the pin low while it is held
+        if joy.button.value():
+            self.held_since = None
+        elif self.held_since is None:
+            self.held_since = time.ticks_ms()
+        elif time.ticks_diff(time.ticks_ms(), self.held_since) > Profiler.HOLD_MS:
+            self.held_since = None
+            # The hold was for the report, not for the game
+            joy.cancel_press()
+            return True
+        return False
+
+    def report(self) -> list:
+        """min/avg/p95/max in microseconds of each phase over the sampled frames"""
+        rows = []
+        count = self.count
+        for phase in range(len(Profiler.PHASES)):
+            start = phase * Profiler.SAMPLES
+            values = sorted(self.samples[start:start + count]) if count else [0]
+            rows.append((
+                Profiler.PHASES[phase],
+                values[0],
+                sum(values) // len(values),
+                values[min(len(values) - 1, len(values) * 95 // 100)],
+                values[-1],
+            ))
+        return rows
+
+    def dump(self):
+        print("{} frames, us: {:>7} {:>7} {:>7} {:>7}".format(self.count, "min", "avg", "p95", "max"))
+        for name, low, avg, p95, high in self.report():
+            print("{:>16}: {:>7} {:>7} {:>7} {:>7}".format(name, low, avg, p95, high))
+        if renderer.running:
+            print("{:>16}: {}".format("render worker", renderer.stats()))
+
+profiler = Profiler()
+
+
+class FrameRecorder():
+    """
+    Captures every rendered frame into a stream, see capture.py to play it.
+
+    The stream starts with MAGIC, the width and the height. Every frame is a
+    16 bit little endian payload length, with KEYFRAME set for frames encoded
+    against a black screen rather than the frame before, and the payload: the
+    cells XOR the previous frame, run length encoded. A byte below 0x80 skips
+    that many plus one unchanged cells, otherwise bits 4-6 are the number of
+    cells minus one to XOR with the low nibble. Cells past the end of the
+    payload are unchanged, so a frame like the one before takes two bytes.
+    """
+    MAGIC = b"PTF1"
+    HEADER = "<4sBB"
+    KEYFRAME = 0x8000
+    KEYFRAME_EVERY = 64
+    MAX_SKIP = 0x80
+    MAX_RUN = 8
+
+    def __init__(self, stream, size=1024):
+        self.stream = stream
+        self.previous = bytearray(SCREEN_SIZE)
+        # A frame never takes more than a byte per cell
+        self.frame = bytearray(2 + SCREEN_SIZE)
+        self.buf = bytearray(size)
+        self.used = 0
+        self.render = None
+
+        self.frames = 0
+        self.bytes = struct.calcsize(FrameRecorder.HEADER)
+        self.total_us = 0
+        self.max_us = 0
+        stream.write(struct.pack(FrameRecorder.HEADER, FrameRecorder.MAGIC, SCREEN_WIDTH, SCREEN_HEIGHT))
+
+    def enable(self):
+        """Capture every FrameBuffer.render(), before the game is created"""
+        render = self.render = FrameBuffer.render
+        recorder = self
+
+        def captured(screen):
+            recorder.capture(screen)
+            render(screen)
+
+        FrameBuffer.render = captured
+
+    def disable(self):
+        if self.render:
+            FrameBuffer.render = self.render
+            self.render = None
+        self.flush()
+
+    def capture(self, screen):
+        start = time.ticks_us()
+        content = screen.content
+        previous = self.previous
+        keyframe = self.frames % FrameRecorder.KEYFRAME_EVERY == 0
+        if keyframe:
+            previous[:] = ZEROS
+        length = 0
+        if keyframe or content != previous:
+            length = self.encode(content, previous)
+            previous[:] = content
+        struct.pack_into("<H", self.frame, 0, length | (FrameRecorder.KEYFRAME if keyframe else 0))
+        self.write(2 + length)
+
+        spent = time.ticks_diff(time.ticks_us(), start)
+        self.frames += 1
+        self.total_us += spent
+        self.max_us = max(self.max_us, spent)
+
+    def encode(self, content, previous) -> int:
+        out = self.frame
+        used = 2
+        skip = 0
+        idx = 0
+        while idx < SCREEN_SIZE:
+            delta = content[idx] ^ previous[idx]
+            idx += 1
+            if not delta:
+                skip += 1
+                continue
+            while skip:
+                count = min(skip, FrameRecorder.MAX_SKIP)
+                out[used] = count - 1
+                used += 1
+                skip -= count
+            run = 1
+            while idx < SCREEN_SIZE and run < FrameRecorder.MAX_RUN and content[idx] ^ previous[idx] == delta:
+                run += 1
+                idx += 1
+            out[used] = 0x80 | (run - 1) << 4 | delta
+            used += 1
+        return used - 2
+
+    def write(self, length: int):
+        if self.used + length > len(self.buf):
+            self.flush()
+        self.buf[self.used:self.used + length] = memoryview(self.frame)[:length]
+        self.used += length
+        self.bytes += length
+
+    def flush(self):
+        self.stream.write(memoryview(self.buf)[:self.used])
+        self.used = 0
+
+    def stats(self) -> str:
+        frames = self.frames or 1
+        return "frames {} bytes {} bytes/frame {} us/frame avg {} max {}".format(
+            self.frames, self.bytes, self.bytes // frames, self.total_us // frames, self.max_us)
+
+
+# Set to True to push frames to the LEDs from the second core, see RenderWorker
+OFFLOAD = False
+
+
+class RenderWorker():
+    """
+    Pushes frames to the LEDs from a second thread, on the second core of the
+    RP2040, so the game computes frame N+1 while the LEDs take frame N.
+
+    start() routes FrameBuffer.render through submit(), which copies the
+    frame into the back buffer and raises the pending flag. The worker swaps
+    back and front, lowers the flag and renders the front buffer. Only the
+    worker writes the flag down and only submit() writes it up, so no lock
+    is needed: submit() waits while the previous frame is still pending.
+
+    Start it before Profiler.enable(), the worker must not call into the
+    profiler's phase stack from its thread. It times its renders itself.
+    """
+    IDLE_MS = 1
+
+    def __init__(self):
+        self.front = FrameBuffer()
+        self.back = FrameBuffer()
+        self.pending = False
+        self.running = False
+        self.alive = False
+        self.render = None
+
+        self.submitted = 0
+        self.rendered = 0
+        self.waits = 0
+        self.render_us = 0
+        self.render_max_us = 0
+
+    def start(self):
+        if self.running:
+            return
+        self.render = FrameBuffer.render
+        self.running = True
+        self.alive = True
+        worker = self
+        FrameBuffer.render = lambda screen: worker.submit(screen)
+
+        if sys.implementation.name == "micropython":
+            import _thread
+            _thread.start_new_thread(self.loop, ())
+        else:
+            import threading
+            threading.Thread(target=self.loop, daemon=True).start()
+
+    def stop(self):
+        """Push the last frame, stop the worker and render on this core again"""
+        if not self.running:
+            return
+        self.flush()
+        self.running = False
+        while self.alive:
+            time.sleep_ms(RenderWorker.IDLE_MS)
+        FrameBuffer.render = self.render
+        self.render = None
+
+    def submit(self, screen):
+        if self.pending:
+            self.waits += 1
+            while self.pending:
+                time.sleep_ms(0)
+        self.back.content[:] = screen.content
+        self.submitted += 1
+        self.pending = True
+
+    def flush(self):
+        """Wait until every submitted frame is on the LEDs"""
+        while self.rendered != self.submitted:
+            time.sleep_ms(RenderWorker.IDLE_MS)
+
+    def loop(self):
+        render = self.render
+        while self.running:
+            if not self.pending:
+                time.sleep_ms(RenderWorker.IDLE_MS)
+                continue
+            self.front, self.back = self.back, self.front
+            self.pending = False
+            start = time.ticks_us()
+            render(self.front)
+            spent = time.ticks_diff(time.ticks_us(), start)
+            self.render_us += spent
+            self.render_max_us = max(self.render_max_us, spent)
+            self.rendered += 1
+        self.alive = False
+
+    def stats(self) -> str:
+        rendered = self.rendered or 1
+        return "frames {} rendered {} waits {} render us avg {} max {}".format(
+            self.submitted, self.rendered, self.waits, self.render_us // rendered, self.render_max_us)
+
+renderer = RenderWorker()
+
+
+class Game():
+    """
+    A game split into ticks, so it can run without the board.
+
+    step(inputs) advances the game by one tick reading a Joystick-like input
+    source and returns False once the game is over. Frames go to the display
+    sink, a callable taking the screen FrameBuffer. run() is the loop on the
+    device: the joystick, the LEDs and a Clock at PERIOD_MS.
+    """
+    PERIOD_MS = 50
+
+    def __init__(self, display=None):
+        self.screen = FrameBuffer()
+        self.display = display or FrameBuffer.render
+        self.clock = None
+
+    def step(self, inputs) -> bool:
+        raise NotImplementedError
+
+    def show(self):
+        if self.clock is None or self.clock.should_render():
+            self.display(self.screen)
+
+    def run(self, inputs=None):
+        inputs = inputs or joy
+        self.clock = Clock(self.PERIOD_MS)
+        while self.step(inputs):
+            inputs.end_tick()
+            self.clock.tick()
+        # The last tick ended the game, drop its sample so game_over() and
+        # the menu read the stick afresh. Not through inputs, a recording
+        # ends with the tick the game was over in.
+        joy.end_tick()
+        if PROFILE:
+            print(self.clock.stats())
+        self.game_over()
+
+    def game_over(self):
+        pass
+
+
+class Tetris(Game):
+    def __init__(self, display=None):
+        super().__init__(display)
         self.init_x = 3
         self.init_y = 6
         self.next_visible_y = self.init_y + 5
@@ -245,84 +1377,92 @@ class Tetris():
         joy.map_y_min = 0
         joy.map_y_max = 10
 
-        self.screen = FrameBuffer()
         self.concrete = FrameBuffer()
+        self.well = Bitboard()
+        self.hud = FrameBuffer()
+        self.layers = Layers(self.screen, self.concrete, self.hud)
+        self.shown_score = None
         self.reduced = 0
 
+        self.x = self.init_x
+        self.y = self.init_y
+        self.curr = figures.random_tetramino(rng)
+        self.next = figures.random_tetramino(rng)
 
-    def run(self):
-        x = self.init_x
-        y = self.init_y
 
-        curr = figures.random_tetramino()
-        next = figures.random_tetramino()
+    def step(self, inputs) -> bool:
+        if self.ipass >= 10:
+            self.ipass = 0
+            self.y += 1
 
-        while True:
-            if self.ipass >= 10:
-                self.ipass = 0
-                y += 1
-
-            self.draw_score()
-
-            x_diff = joy.read_x(no_reset=True)
-            new_x = x + x_diff
-            if (new_x >= 0 and new_x < SCREEN_WIDTH
-                and not self.concrete.collides(new_x, y, figure=curr)):
-                x = new_x
-            joy.reset_x()
-
-            if joy.was_pressed():
-                rotated = curr.rotate()
-                shift = rotated.height - rotated.width if x + rotated.width >= SCREEN_WIDTH else 0
-
-                if not self.concrete.collides(x + shift, y, figure=rotated):
-                    curr = rotated
-                    x += shift
-
-            if y > self.next_visible_y:
-                self.screen.draw(self.init_x, self.init_y, next)
-            if not self.concrete.collides(x, y, figure=curr):
-                self.screen.draw(x, y, curr)
-            else:
-                self.screen.draw(x, y - 1, curr)
-                self.concrete.draw(x, y - 1, curr)
-                x = self.init_x
-                y = self.init_y + 1
-                if self.concrete.collides(x, y, figure=curr):
-                    self.game_over(curr)
-                    return
+        self.draw_score()
+        self.layers.begin()
 
-                curr = next
-                next = figures.random_tetramino()
+        x_diff = inputs.read_x(no_reset=True)
+        new_x = self.x + x_diff
+        if (new_x >= 0 and new_x < SCREEN_WIDTH
+            and not self.well.collides(new_x, self.y, figure=self.curr)):
+            self.x = new_x
+        inputs.reset_x()
 
-                self.reduced = self.reduce_concrete()
-                self.score += self.reduced
+        if inputs.was_pressed():
+            rotated = self.curr.rotate()
+            shift = rotated.height - rotated.width if self.x + rotated.width >= SCREEN_WIDTH else 0
 
-            self.screen.render()
-            self.screen.copy_from(self.concrete)
-            self.shift_concrete()
+            if not self.well.collides(self.x + shift, self.y, figure=rotated):
+                self.curr = rotated
+                self.x += shift
 
-            if self.score > 99:
-                self.score = 0
-            self.ipass += max(1, self.score // 10) + joy.read_y(up=0, down=10)
-            time.sleep_ms(50)
+        if self.y > self.next_visible_y:
+            self.layers.draw(self.init_x, self.init_y, self.next)
+        if not self.well.collides(self.x, self.y, figure=self.curr):
+            self.layers.draw(self.x, self.y, self.curr)
+        else:
+            self.layers.draw(self.x, self.y - 1, self.curr)
+            self.concrete.draw(self.x, self.y - 1, self.curr)
+            self.well.place(self.x, self.y - 1, self.curr)
+            self.layers.invalidate(self.concrete, self.y - 1, self.curr.height)
+            self.x = self.init_x
+            self.y = self.init_y + 1
+            if self.well.collides(self.x, self.y, figure=self.curr):
+                return False
+
+            self.curr = self.next
+            self.next = figures.random_tetramino(rng)
+
+            self.reduced = self.reduce_concrete()
+            self.score += self.reduced
+
+        self.show()
+        self.shift_concrete()
+
+        if self.score > 99:
+            self.score = 0
+        self.ipass += max(1, self.score // 10) + inputs.read_y(up=0, down=10)
+        return True
 
 
     def draw_score(self):
         self.score %= 100
         self.speed = self.score // 10
-        self.screen.draw(0, 0, figures.DIGITS[self.speed])
-        self.screen.draw(4, 0, figures.DIGITS[self.score % 10])
-        self.screen.draw(0, 5, HLINE)
+        if self.score == self.shown_score:
+            return
+        self.shown_score = self.score
+        self.hud.clear()
+        self.hud.draw(0, 0, figures.DIGITS[self.speed])
+        self.hud.draw(4, 0, figures.DIGITS[self.score % 10])
+        self.hud.draw(0, 5, HLINE)
+        self.layers.invalidate(self.hud, 0, HUD_HEIGHT)
 
 
     def reduce_concrete(self) -> int:
         score = 0
         for idx in range(SCREEN_HEIGHT, 5, -1):
             row_idx = (idx - 1)
-            if is_full(self.concrete.row(row_idx)):
+            if self.well.is_full(row_idx):
                 score += 1
                 self.concrete.clear(_from=row_idx*SCREEN_WIDTH, to=(row_idx+1)*SCREEN_WIDTH)
+                self.well.clear(_from=row_idx, to=row_idx+1)
         return score
 
 
@@ -332,21 +1472,27 @@ class Tetris():
 
         to_idx = SCREEN_HEIGHT - 1
         from_idx = SCREEN_HEIGHT - 1
+        rows = self.well.rows
         for _ in range(SCREEN_HEIGHT):
-            if is_empty(self.concrete.row(from_idx)):
+            if not rows[from_idx]:
                 from_idx -= 1
                 continue
             if from_idx != to_idx:
                 target = self.concrete.row(to_idx)
                 target[:] = self.concrete.row(from_idx)
+                rows[to_idx] = rows[from_idx]
             from_idx -= 1
             to_idx -= 1
 
         # +1 to compensate last for loop iteration
         self.concrete.clear(to=(to_idx + 1) * SCREEN_WIDTH)
+        self.well.clear(to=to_idx + 1)
+        self.reduced = 0
+        self.layers.invalidate(self.concrete)
 
 
-    def game_over(self, figure):
+    def game_over(self):
+        figure = self.curr
         while not joy.was_pressed():
             for idx in range(1, len(COLORS)):
                 self.screen.draw(self.init_x, self.init_y, figure, color=idx)
@@ -357,29 +1503,43 @@ class Tetris():
                 time.sleep_ms(500)
 
 class Dot():
+    """
+    A point or a direction. The operators return new Dots, the hot paths use
+    set_xy(), add() and wrap() which change the Dot in place and allocate
+    nothing.
+    """
     def __init__(self, x = 0, y = 0):
         self.x = x
         self.y = y
 
+    def set_xy(self, x: int, y: int) -> "Dot":
+        self.x = x
+        self.y = y
+        return self
+
+    def add(self, direction: "Dot") -> "Dot":
+        self.x += direction.x
+        self.y += direction.y
+        return self
+
+    def wrap(self) -> "Dot":
+        """Bring a Dot one step off the screen back in on the other side"""
+        if self.x == -1:
+            self.x = SCREEN_WIDTH - 1
+        elif self.x == SCREEN_WIDTH:
+            self.x = 0
+
+        if self.y == -1:
+            self.y = SCREEN_HEIGHT - 1
+        elif self.y == SCREEN_HEIGHT:
+            self.y = 0
+        return self
+
     def move(self, direction: "Dot") -> "Dot":
         return self + direction
 
     def move_wrap(self, direction: "Dot") -> "Dot":
-        dot = self.move(direction)
-        x = dot.x
-        y = dot.y
-
-        if x == -1:
-            x = SCREEN_WIDTH - 1
-        elif x == SCREEN_WIDTH:
-            x = 0
-
-        if y == -1:
-            y = SCREEN_HEIGHT - 1
-        elif y == SCREEN_HEIGHT:
-            y = 0
-
-        return Dot(x, y)
+        return self.move(direction).wrap()
 
     def set(self, other) -> bool:
         self.x = other.x
@@ -413,42 +1573,139 @@ class Dot():
     def __str__(self) -> str:
         return f"Dot(x={self.x}, y={self.y})"
 
-
-class Missile():
-    def __init__(self, pos: Dot, direction: Dot, group: int):
-        self.pos = pos
-        self.direction = direction
-        self.group = group
-    
-    def move(self) -> bool:
-        self.pos = self.pos.move(self.direction)
-        return self.visible()
-
-    def hide(self):
-        self.pos.set(Dot(-1, -1))
-
-    def visible(self):
-        return not self.pos.outside()
+# Shared directions, never change them in place
+LEFT = Dot(-1, 0)
+UP = Dot(0, -1)
+RIGHT = Dot(1, 0)
+DOWN = Dot(0, 1)
+# Clockwise, so the opposite direction is two steps away
+DIRECTIONS = (LEFT, UP, RIGHT, DOWN)
+
+
+class EntityPool():
+    """
+    Fixed capacity store of moving points: missiles, bullets, obstacles.
+
+    Entity i is x[i], y[i] moving by dx[i], dy[i] every move(), in parallel
+    signed byte arrays, and the first count entities are in use. remove()
+    moves the last entity into the hole, so entity indexes change. kill()
+    only marks an entity, for loops that must not reorder the pool, and
+    sweep() removes the killed ones afterwards.
+    """
+    def __init__(self, capacity: int):
+        self.x = array("b", bytes(capacity))
+        self.y = array("b", bytes(capacity))
+        self.dx = array("b", bytes(capacity))
+        self.dy = array("b", bytes(capacity))
+        self.group = array("b", bytes(capacity))
+        self.alive = bytearray(capacity)
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, x: int, y: int, dx=0, dy=0, group=0) -> int:
+        """Index of the new entity, -1 when the pool is full"""
+        idx = self.count
+        if idx == len(self.alive):
+            return -1
+        self.x[idx] = x
+        self.y[idx] = y
+        self.dx[idx] = dx
+        self.dy[idx] = dy
+        self.group[idx] = group
+        self.alive[idx] = 1
+        self.count = idx + 1
+        return idx
+
+    def remove(self, idx: int):
+        last = self.count - 1
+        self.x[idx] = self.x[last]
+        self.y[idx] = self.y[last]
+        self.dx[idx] = self.dx[last]
+        self.dy[idx] = self.dy[last]
+        self.group[idx] = self.group[last]
+        self.alive[idx] = self.alive[last]
+        self.count = last
+
+    def kill(self, idx: int):
+        self.alive[idx] = 0
+
+    def sweep(self):
+        idx = 0
+        while idx < self.count:
+            if self.alive[idx]:
+                idx += 1
+            else:
+                self.remove(idx)
+
+    def clear(self):
+        self.count = 0
+
+    def move(self):
+        x = self.x
+        y = self.y
+        dx = self.dx
+        dy = self.dy
+        for idx in range(self.count):
+            x[idx] += dx[idx]
+            y[idx] += dy[idx]
+
+    def shift(self, dx: int, dy: int):
+        """Move every entity by dx, dy"""
+        x = self.x
+        y = self.y
+        for idx in range(self.count):
+            x[idx] += dx
+            y[idx] += dy
+
+    def cull(self, offset=0):
+        """Remove the entities off the screen, y[i] + offset is the screen row"""
+        x = self.x
+        y = self.y
+        top = -offset
+        bottom = SCREEN_HEIGHT - offset
+        idx = 0
+        while idx < self.count:
+            if 0 <= x[idx] < SCREEN_WIDTH and top <= y[idx] < bottom:
+                idx += 1
+            else:
+                self.remove(idx)
+
+    def draw(self, target, color: int, figure: Figure = None, offset=0):
+        """
+        Draw every entity into target, a FrameBuffer or Layers: a pixel, or
+        figure when it fits the screen vertically. y[i] + offset is the
+        screen row.
+        """
+        x = self.x
+        y = self.y
+        if figure is None:
+            for idx in range(self.count):
+                row = y[idx] + offset
+                if 0 <= x[idx] < SCREEN_WIDTH and 0 <= row < SCREEN_HEIGHT:
+                    target.set(x[idx], row, color)
+            return
+        bottom = SCREEN_HEIGHT - figure.height
+        for idx in range(self.count):
+            row = y[idx] + offset
+            if 0 <= row <= bottom:
+                target.draw(x[idx], row, figure, color)
 
 class Tank():
+    MISSILES = 16
+
     def __init__(self, pos: Dot, lives=3, origin=-1):
-        self.missiles: list[Missile] = []
+        self.missiles = EntityPool(Tank.MISSILES)
         self.pos = pos
         self.origin = origin
         self.is_player = origin == -1
         self.rotation = 0
-        self.rotations = [
-                Dot(-1, 0),
-                Dot(0, -1),
-                Dot(1, 0),
-                Dot(0, 1),
-            ]
-        self.figure = Figure(bytearray(
-            b"\0\3\3"
-            b"\1\3\0"
-            b"\0\3\3"
-        ), width=3)
+        self.rotations = DIRECTIONS
+        self.figure = figures.TANK
         self.lives = lives
+        # Facing the player, as of the last AI tick
+        self.aimed = False
 
     @property
     def direction(self) -> Dot:
@@ -464,38 +1721,25 @@ class Tank():
                 return False
         return rotated > 0
 
+    @property
+    def opposite(self) -> Dot:
+        return self.rotations[(self.rotation + 2) % len(self.rotations)]
+
     def fire(self):
-        self.missiles.append(Missile(self.pos + Dot(1, 1), self.direction, group=self.origin))
+        direction = self.direction
+        self.missiles.add(self.pos.x + 1, self.pos.y + 1, direction.x, direction.y, self.origin)
 
     def move(self, direction: Dot, collides, allow_backword=False):
         if not direction.is_zero():
             if (allow_backword and self.direction.is_opposite(direction)) or not self.rotate(direction):
-                pos = self.pos + direction
-                if not collides(pos.x, pos.y, self.figure):
-                    self.pos = pos
+                x = self.pos.x + direction.x
+                y = self.pos.y + direction.y
+                if not collides(x, y, self.figure):
+                    self.pos.set_xy(x, y)
     
     def move_missiles(self):
-        visible_idx = 0 
-        for m in self.missiles:
-            visible = m.move()
-            if visible:
-                self.missiles[visible_idx] = m
-                visible_idx += 1
-        self.missiles = self.missiles[:visible_idx]
-
-    def collides(self, dot: Dot) -> bool:
-        tank_center = self.pos + Dot(1, 1)
-        distance = tank_center - dot
-        return abs(distance.x) <= 1 and abs(distance.y) <= 1
-
-    def hit(self, tank: "Tank"):
-        if not self.is_player and not tank.is_player:
-            return
-
-        for m in self.missiles:
-            if tank.collides(m.pos):
-                tank.lives -= 1
-                m.hide()
+        self.missiles.move()
+        self.missiles.cull()
 
     def is_dead(self) -> bool:
         return self.lives <= -18
@@ -504,7 +1748,176 @@ class Tank():
         return self.lives <= 0
 
 
-class Tanks():
+class FlowField():
+    """
+    Distances in steps from every top left position of a size x size tank
+    to a target, by one breadth first search over the positions where the
+    tank fits below the HUD. Any number of tanks then find their next step
+    with a lookup. The field is only searched again when the target moves,
+    other tanks are left for the move itself to run into.
+
+    update() searches the whole field at once. start() and search() do the
+    same a few queue pops at a time, for work spread over frames.
+    """
+    UNREACHED = 0xFF
+    # Queue pops per search() call
+    CHUNK = 32
+    # Cell offsets of the neighbours. For tanks wider than a pixel the
+    # rightmost column is never passable, so a step off a row edge can't
+    # land on a passable cell.
+    STEPS = (-SCREEN_WIDTH, SCREEN_WIDTH, -1, 1)
+
+    def __init__(self, top=HUD_HEIGHT, size=3):
+        self.passable = bytearray(SCREEN_SIZE)
+        self.left = 0
+        self.right = SCREEN_WIDTH - size
+        self.top = top
+        self.bottom = SCREEN_HEIGHT - size
+        for y in range(self.top, self.bottom + 1):
+            for x in range(self.left, self.right + 1):
+                self.passable[y * SCREEN_WIDTH + x] = 1
+
+        self.distance = bytearray(SCREEN_SIZE)
+        self.unreached = bytes([FlowField.UNREACHED]) * SCREEN_SIZE
+        self.queue = bytearray(SCREEN_SIZE)
+        self.head = 0
+        self.tail = 0
+        self.target = -1
+        self.searches = 0
+
+    def done(self) -> bool:
+        return self.head == self.tail
+
+    def update(self, x: int, y: int):
+        """Search from x, y, moved into the passable area, unless it is the last target"""
+        self.start(x, y)
+        self.search(SCREEN_SIZE)
+
+    def start(self, x: int, y: int):
+        """Begin a search from x, y, unless it is the target searched last"""
+        x = min(max(x, self.left), self.right)
+        y = min(max(y, self.top), self.bottom)
+        target = y * SCREEN_WIDTH + x
+        if target == self.target:
+            return
+        self.target = target
+        self.searches += 1
+
+        self.distance[:] = self.unreached
+        self.distance[target] = 0
+        self.queue[0] = target
+        self.head = 0
+        self.tail = 1
+
+    def search(self, pops=CHUNK) -> bool:
+        """Carry on the search for up to pops cells, True once it is done"""
+        distance = self.distance
+        passable = self.passable
+        queue = self.queue
+        head = self.head
+        tail = self.tail
+        end = head + pops
+        while head < tail and head < end:
+            cell = queue[head]
+            head += 1
+            step = distance[cell] + 1
+            for offset in FlowField.STEPS:
+                near = cell + offset
+                if 0 <= near < SCREEN_SIZE and passable[near] and distance[near] == FlowField.UNREACHED:
+                    distance[near] = step
+                    queue[tail] = near
+                    tail += 1
+        self.head = head
+        self.tail = tail
+        return head == tail
+
+    def next(self, x: int, y: int, prefer: Dot) -> Dot:
+        """The direction one step closer to the target, prefer on a tie, None if there is none"""
+        if not (self.left <= x <= self.right and self.top <= y <= self.bottom):
+            return None
+        cell = y * SCREEN_WIDTH + x
+        distance = self.distance
+        best = None
+        closest = distance[cell]
+        for direction in DIRECTIONS:
+            if not (self.left <= x + direction.x <= self.right and
+                    self.top <= y + direction.y <= self.bottom):
+                continue
+            near = distance[cell + direction.y * SCREEN_WIDTH + direction.x]
+            if near < closest or (near == closest and best is not None and direction is prefer):
+                best = direction
+                closest = near
+        return best
+
+
+class Scheduler():
+    """
+    Spreads work over frames within a time budget.
+
+    start() takes a generator that yields between small jobs. run() is
+    called once per frame and resumes it, job by job, until it is done or
+    budget_us microseconds have passed; the rest carries over to the next
+    frame. One job always runs, so the work finishes whatever the budget.
+    A budget of None runs the work to the end in one frame.
+
+    How many jobs ran goes to inputs.ran_jobs(), so InputRecorder logs it,
+    and a replay runs the logged count instead of timing, through
+    inputs.planned_jobs().
+    """
+
+    def __init__(self, budget_us=None):
+        self.budget_us = budget_us
+        self.jobs = None
+
+        self.rounds = 0
+        self.steps = 0
+        self.carried = 0
+        self.max_us = 0
+
+    def busy(self) -> bool:
+        return self.jobs is not None
+
+    def start(self, jobs):
+        self.jobs = jobs
+        self.rounds += 1
+
+    def run(self, inputs):
+        if self.jobs is None:
+            return
+        budget = self.budget_us
+        planned = inputs.planned_jobs()
+        count = 0
+        start = time.ticks_us()
+        while True:
+            try:
+                next(self.jobs)
+            except StopIteration:
+                self.jobs = None
+            count += 1
+            spent = time.ticks_diff(time.ticks_us(), start)
+            if self.jobs is None:
+                break
+            if planned is not None:
+                if count >= planned:
+                    self.carried += 1
+                    break
+            elif budget is not None and spent >= budget:
+                self.carried += 1
+                break
+        self.steps += count
+        self.max_us = max(self.max_us, spent)
+        inputs.ran_jobs(count)
+
+    def stats(self) -> str:
+        return "rounds {} jobs {} carried {} max {}us".format(
+            self.rounds, self.steps, self.carried, self.max_us)
+
+
+class Tanks(Game):
+    # Owner bits of a cell: the player, or the enemy index plus one
+    PLAYER = 0x80
+    ENEMY = 0x7F
+
     STAGE_SPAWN = 0
     STAGE_MOVE = 1
     STAGE_ROTATE = 2
@@ -516,127 +1929,180 @@ class Tanks():
         STAGE_ROTATE, STAGE_ROTATE,
         STAGE_FIRE, STAGE_FIRE, STAGE_FIRE,
     )
-
-    def __init__(self):
-        self.screen = FrameBuffer()
+    # Stage weights of an AI round, more aggressive when the player has
+    # one life left
+    STAGES_CORNERED = (
+        STAGE_FIRE, STAGE_FIRE, STAGE_FIRE, STAGE_FIRE,
+        STAGE_MOVE, STAGE_MOVE,
+        STAGE_ROTATE, STAGE_ROTATE,
+        STAGE_NONE,
+    )
+    STAGES_WEIGHTED = (
+        STAGE_FIRE, STAGE_FIRE,
+        STAGE_MOVE, STAGE_MOVE, STAGE_MOVE,
+        STAGE_ROTATE, STAGE_ROTATE,
+        STAGE_NONE,
+    )
+    # Microseconds of AI work per frame on the board. Elsewhere a round
+    # always finishes in the frame it started, so headless runs don't depend
+    # on the speed of the machine. Replays of board sessions run the jobs
+    # the log says, see Scheduler.
+    AI_BUDGET_US = 4000 if sys.implementation.name == "micropython" else None
+    # Screen rows update_sight() scans per AI job
+    SIGHT_ROWS = 8
+
+    def __init__(self, display=None):
+        super().__init__(display)
+        self.hud = FrameBuffer()
+        self.layers = Layers(self.screen, self.hud)
+        self.shown_score = None
+        self.shown_lives = None
+        self.ai_step = 10
+        self.ai_round = 10
         self.tank = Tank(Dot(3, 16))
+        # Direction of the stick, reused every tick
+        self.stick = Dot()
         self.score = 0
         self.spawns = [Dot(0, 6), Dot(5, 6), Dot(0, 29), Dot(5, 29)]
         self.enemies = []
+        self.flow = FlowField()
+        self.scheduler = Scheduler(Tanks.AI_BUDGET_US)
+        # Ratings of an AI round by spawn, and by enemy with the enemies
+        # rated, see plan(). At most one enemy per spawn.
+        self.spawn_ratings = array("i", [0] * len(self.spawns))
+        self.ratings = array("i", [0] * len(self.spawns))
+        self.rated = [None] * len(self.spawns)
+        # Which tank covers each cell this tick, see stamp_tanks()
+        self.owners = bytearray(SCREEN_SIZE)
+        # Per tick facts of the AI, see update_sight()
+        self.row_masks = bytearray(SCREEN_HEIGHT)
+        self.col_masks = array("l", [0] * SCREEN_WIDTH)
+        self.player_x = 0
+        self.player_y = 0
         self.explosion = Figure(bytearray(
             b"\2\0\2"
             b"\0\2\0"
             b"\2\0\2"
         ), width=3)
 
-    def run(self):
-        step = 10
-        round = 10
-        while True:
-            self.screen.clear()
-            self.draw_score()
-            self.draw_lives()
-
-            x = joy.read_x()
-            y = joy.read_y()
-            if x and y:
-                x = 0
-
-            for e in self.enemies:
-                self.draw_tank(e)
-            self.tank.move(Dot(x, y), self.screen.collides)
-            self.draw_tank(self.tank)
-
-            if joy.was_pressed():
-                self.tank.fire()
-            self.tank.move_missiles()
-
-            for e in self.enemies:
-                e.move_missiles()
-                self.tank.hit(e)
-                e.hit(self.tank)
-                self.draw_missiles(e.missiles)
-            self.draw_missiles(self.tank.missiles)
-
-            count = self.remove_dead_enemies()
-            self.score += count
+    def step(self, inputs) -> bool:
+        self.draw_hud()
+        self.layers.begin()
 
-            self.screen.render()
-            if self.tank.is_dead():
-                self.game_over()
-                return
+        x = inputs.read_x()
+        y = inputs.read_y()
+        if x and y:
+            x = 0
 
-            speedup = self.score // 10
-            if step >= round - speedup:
-                self.ai()
-                step = 0
-            step += 1
+        for e in self.enemies:
+            self.draw_tank(e)
+        self.tank.move(self.stick.set_xy(x, y), self.screen.collides)
+        self.draw_tank(self.tank)
 
-            time.sleep_ms(50)
+        if inputs.was_pressed():
+            self.tank.fire()
+        self.tank.move_missiles()
+        for e in self.enemies:
+            e.move_missiles()
+
+        self.stamp_tanks()
+        self.resolve_hits()
+        for e in self.enemies:
+            self.draw_missiles(e.missiles)
+        self.draw_missiles(self.tank.missiles)
+
+        count = self.remove_dead_enemies()
+        self.score += count
+
+        self.show()
+        if self.tank.is_dead():
+            return False
 
-    def ai(self):
-        # Enhanced AI with better decision making
+        speedup = self.score // 10
+        # A round spread over frames holds off the next one, so on the board
+        # a high score can't make the AI act more often than a round lasts
+        if self.ai_step >= self.ai_round - speedup and not self.scheduler.busy():
+            self.scheduler.start(self.plan())
+            self.ai_step = 0
+        self.scheduler.run(inputs)
+        self.ai_step += 1
+        return True
+
+    def plan(self):
+        """
+        One round of the AI as a generator, see Scheduler. Every yield ends
+        a job: picking the stage, rating a spawn, scanning a few rows of the
+        screen, rating an enemy, searching part of the flow field. The round
+        can finish frames after it started. The ratings, and the sight masks
+        behind them, may then be frames old, but the picked tank is checked
+        and aimed again before it acts.
+        """
         stage = Tanks.STAGE_SPAWN
         if len(self.enemies) > 1:
             # Weight stages based on game state
-            weighted_stages = []
-            
-            # More aggressive when player has fewer lives
             if self.tank.lives <= 1:
-                weighted_stages.extend([Tanks.STAGE_FIRE] * 4)
-                weighted_stages.extend([Tanks.STAGE_MOVE] * 2)
+                stage = rng.choice(Tanks.STAGES_CORNERED)
             else:
-                weighted_stages.extend([Tanks.STAGE_FIRE] * 2)
-                weighted_stages.extend([Tanks.STAGE_MOVE] * 3)
-            
-            weighted_stages.extend([Tanks.STAGE_ROTATE] * 2)
-            weighted_stages.append(Tanks.STAGE_NONE)
-            
-            stage = random.choice(weighted_stages)
+                stage = rng.choice(Tanks.STAGES_WEIGHTED)
 
         if stage == Tanks.STAGE_SPAWN:
             if len(self.enemies) >= 4:
                 return
+            yield
             
-            # Smart spawning - prefer spawns closer to player
-            spawn_priorities = []
-            player_pos = self.tank.pos
-            
-            for idx, spawn_pos in enumerate(self.spawns):
-                is_used = any(idx == e.origin for e in self.enemies)
-                if not is_used:
+            # Smart spawning - prefer spawns closer to player, a used
+            # spawn weighs nothing
+            ratings = self.spawn_ratings
+            total_weight = 0
+            for idx in range(len(self.spawns)):
+                spawn_pos = self.spawns[idx]
+                player_pos = self.tank.pos
+                ratings[idx] = 0
+                if not self.spawn_used(idx):
                     # Calculate distance to player (Manhattan distance)
                     distance = abs(spawn_pos.x - player_pos.x) + abs(spawn_pos.y - player_pos.y)
                     # Closer spawns get higher priority (lower distance = higher priority)
-                    priority = 100 - distance
-                    spawn_priorities.append((idx, priority))
+                    ratings[idx] = 100 - distance
+                    total_weight += ratings[idx]
+                yield
             
-            if spawn_priorities:
+            if total_weight > 0 and len(self.enemies) < 4:
                 # Weighted random selection favoring closer spawns
-                total_weight = sum(priority for _, priority in spawn_priorities)
-                if total_weight > 0:
-                    rand_val = random.randrange(total_weight)
-                    current_weight = 0
-                    for idx, priority in spawn_priorities:
-                        current_weight += priority
-                        if rand_val < current_weight:
-                            pos = self.spawns[idx]
-                            self.enemies.append(Tank(pos, lives=1, origin=idx))
+                rand_val = rng.randrange(total_weight)
+                current_weight = 0
+                for idx in range(len(self.spawns)):
+                    current_weight += ratings[idx]
+                    if rand_val < current_weight:
+                        if self.spawn_used(idx):
                             return
+                        pos = self.spawns[idx]
+                        self.enemies.append(Tank(Dot(pos.x, pos.y), lives=1, origin=idx))
+                        return
                             
         elif stage == Tanks.STAGE_NONE:
             return
         else:
             # Select tank based on strategic priority
-            active_tanks = [t for t in self.enemies if not t.is_dying()]
-            if not active_tanks:
+            rated = self.rated
+            ratings = self.ratings
+            count = 0
+            for tank in self.enemies:
+                if not tank.is_dying():
+                    rated[count] = tank
+                    count += 1
+            if not count:
                 return
+            yield
                 
             # Prioritize tanks that can see the player or are closer
-            tank_priorities = []
-            player_pos = self.tank.pos
+            for first in range(0, SCREEN_HEIGHT, Tanks.SIGHT_ROWS):
+                self.update_sight(first, first + Tanks.SIGHT_ROWS)
+                yield
             
-            for tank in active_tanks:
+            total_weight = 0
+            for idx in range(count):
+                tank = rated[idx]
+                player_pos = self.tank.pos
                 priority = 1
                 
                 # Higher priority for tanks closer to player
@@ -644,28 +2110,47 @@ class Tanks():
                 priority += max(0, 20 - distance)
                 
                 # Higher priority for tanks that can hit player in current direction
-                if self.can_hit_player(tank):
+                tank.aimed = self.can_hit_player(tank)
+                if tank.aimed:
                     priority += 15
                 
                 # Higher priority for tanks with clear line of sight
                 if self.has_line_of_sight(tank, player_pos):
                     priority += 10
                 
-                tank_priorities.append((tank, priority))
+                ratings[idx] = priority
+                total_weight += priority
+                yield
             
             # Weighted selection
-            total_weight = sum(priority for _, priority in tank_priorities)
             if total_weight <= 0:
-                tank = random.choice(active_tanks)
+                tank = rated[rng.randrange(count)]
             else:
-                rand_val = random.randrange(total_weight)
+                rand_val = rng.randrange(total_weight)
                 current_weight = 0
-                tank = active_tanks[0]  # fallback
-                for t, priority in tank_priorities:
-                    current_weight += priority
+                tank = rated[0]  # fallback
+                for idx in range(count):
+                    current_weight += ratings[idx]
                     if rand_val < current_weight:
-                        tank = t
+                        tank = rated[idx]
                         break
+            # Don't keep tanks alive through the table
+            for idx in range(count):
+                rated[idx] = None
+
+            if stage == Tanks.STAGE_MOVE:
+                # Towards where the player is now, the field is searched in parts
+                player_pos = self.tank.pos
+                self.flow.start(player_pos.x, player_pos.y)
+                while not self.flow.search():
+                    yield
+
+            # Shot or removed while the round was running
+            if tank.is_dying() or tank not in self.enemies:
+                return
+            self.player_x = self.tank.pos.x + 1
+            self.player_y = self.tank.pos.y + 1
+            tank.aimed = self.can_hit_player(tank)
 
             if stage == Tanks.STAGE_MOVE:
                 self.smart_move(tank)
@@ -676,112 +2161,106 @@ class Tanks():
             elif stage == Tanks.STAGE_ROTATE:
                 self.smart_rotate(tank)
 
+    def update_sight(self, first=0, last=SCREEN_HEIGHT):
+        """
+        Facts the AI shares for this tick: the player's center, and which
+        pixels are lit in every row, and in every column below the HUD, of
+        the screen. A bit per pixel, so a line of sight is one mask test.
+        Scans the rows from first up to last, a full scan begins at row 0.
+        """
+        content = self.screen.content
+        rows = self.row_masks
+        cols = self.col_masks
+        if first == 0:
+            for x in range(SCREEN_WIDTH):
+                cols[x] = 0
+        idx = first * SCREEN_WIDTH
+        for y in range(first, min(last, SCREEN_HEIGHT)):
+            mask = 0
+            bit = 1 << (y - HUD_HEIGHT) if y >= HUD_HEIGHT else 0
+            for x in range(SCREEN_WIDTH):
+                if content[idx]:
+                    mask |= 1 << x
+                    cols[x] |= bit
+                idx += 1
+            rows[y] = mask
+
+        self.player_x = self.tank.pos.x + 1
+        self.player_y = self.tank.pos.y + 1
+
     def can_hit_player(self, tank: Tank) -> bool:
         """Check if tank can potentially hit player in current direction"""
         direction = tank.direction
-        pos = tank.pos + Dot(1, 1)  # Tank center
-        player_center = self.tank.pos + Dot(1, 1)
+        x = tank.pos.x + 1
+        y = tank.pos.y + 1
         
         # Check if player is in the same line as tank's direction
         if direction.x != 0:  # Horizontal movement
-            return (pos.y == player_center.y and
-                   ((direction.x > 0 and pos.x < player_center.x) or
-                    (direction.x < 0 and pos.x > player_center.x)))
+            return (y == self.player_y and
+                   ((direction.x > 0 and x < self.player_x) or
+                    (direction.x < 0 and x > self.player_x)))
         elif direction.y != 0:  # Vertical movement
-            return (pos.x == player_center.x and
-                   ((direction.y > 0 and pos.y < player_center.y) or
-                    (direction.y < 0 and pos.y > player_center.y)))
+            return (x == self.player_x and
+                   ((direction.y > 0 and y < self.player_y) or
+                    (direction.y < 0 and y > self.player_y)))
         return False
 
     def has_line_of_sight(self, tank: Tank, target_pos: Dot) -> bool:
-        """Check if tank has clear line of sight to target"""
-        tank_center = tank.pos + Dot(1, 1)
-        target_center = target_pos + Dot(1, 1)
-        
-        # Simple line of sight - check if target is in cardinal directions
-        dx = target_center.x - tank_center.x
-        dy = target_center.y - tank_center.y
+        """
+        Check if nothing is lit on the line between the centers of tank and
+        a 3x3 target, outside of the two of them
+        """
+        tank_x = tank.pos.x + 1
+        tank_y = tank.pos.y + 1
+        target_x = target_pos.x + 1
+        target_y = target_pos.y + 1
         
         # Must be in cardinal direction (horizontal or vertical line)
-        if dx != 0 and dy != 0:
+        if tank_y == target_y:
+            low = min(tank_x, target_x) + 2
+            high = max(tank_x, target_x) - 2
+            mask = self.row_masks[tank_y]
+        elif tank_x == target_x:
+            low = max(min(tank_y, target_y) + 2 - HUD_HEIGHT, 0)
+            high = max(tank_y, target_y) - 2 - HUD_HEIGHT
+            mask = self.col_masks[tank_x]
+        else:
             return False
-            
-        # Check for obstacles in the path (simplified)
-        steps = max(abs(dx), abs(dy))
-        if steps == 0:
+
+        if low > high:
             return True
-            
-        step_x = 0 if dx == 0 else (1 if dx > 0 else -1)
-        step_y = 0 if dy == 0 else (1 if dy > 0 else -1)
-        
-        # Check a few points along the path
-        for i in range(1, min(steps, 5)):
-            check_pos = Dot(tank_center.x + i * step_x, tank_center.y + i * step_y)
-            if self.screen.collides(check_pos.x, check_pos.y, tank.figure):
-                return False
-                
-        return True
+        return not mask & ((1 << (high + 1)) - (1 << low))
 
     def should_fire(self, tank: Tank) -> bool:
         """Determine if tank should fire based on strategic considerations"""
-        # Fire if can hit player
-        if self.can_hit_player(tank):
+        # Fire if can hit player, as found when the tank was picked
+        if tank.aimed:
             return True
             
         # Fire randomly but less frequently if no clear shot
-        return random.randrange(10) == 0
+        return rng.randrange(10) == 0
 
     def smart_move(self, tank: Tank):
-        """Enhanced movement AI with pathfinding towards player"""
+        """Movement AI following the flow field towards the player, as plan() searched it"""
         self.remove_tank(tank)
         
-        player_pos = self.tank.pos
-        tank_pos = tank.pos
-        
-        # Calculate direction towards player
-        dx = player_pos.x - tank_pos.x
-        dy = player_pos.y - tank_pos.y
-        
-        # Prefer moving towards player
-        preferred_directions = []
-        
-        if abs(dx) > abs(dy):
-            # Horizontal movement preferred
-            if dx > 0:
-                preferred_directions.append(Dot(1, 0))
-            else:
-                preferred_directions.append(Dot(-1, 0))
-            # Add vertical as secondary
-            if dy > 0:
-                preferred_directions.append(Dot(0, 1))
-            elif dy < 0:
-                preferred_directions.append(Dot(0, -1))
-        else:
-            # Vertical movement preferred
-            if dy > 0:
-                preferred_directions.append(Dot(0, 1))
-            else:
-                preferred_directions.append(Dot(0, -1))
-            # Add horizontal as secondary
-            if dx > 0:
-                preferred_directions.append(Dot(1, 0))
-            elif dx < 0:
-                preferred_directions.append(Dot(-1, 0))
-        
-        # Try preferred directions first
-        for direction in preferred_directions:
-            pos = tank.pos + direction
-            if not self.screen.collides(pos.x, pos.y, tank.figure):
-                tank.move(direction, self.screen.collides, allow_backword=True)
-                return
+        direction = self.flow.next(tank.pos.x, tank.pos.y, tank.direction)
+        if direction is not None and self.try_move(tank, direction):
+            return
         
-        # If no preferred direction works, try current direction or reverse
+        # Blocked by another tank, or already next to the player: try
+        # current direction or reverse
         direction = tank.direction
-        pos = tank.pos + direction
-        if self.screen.collides(pos.x, pos.y, tank.figure):
-            direction = direction.opposite()
+        if self.screen.collides(tank.pos.x + direction.x, tank.pos.y + direction.y, tank.figure):
+            direction = tank.opposite
         tank.move(direction, self.screen.collides, allow_backword=True)
 
+    def try_move(self, tank: Tank, direction: Dot) -> bool:
+        if self.screen.collides(tank.pos.x + direction.x, tank.pos.y + direction.y, tank.figure):
+            return False
+        tank.move(direction, self.screen.collides, allow_backword=True)
+        return True
+
     def smart_rotate(self, tank: Tank):
         """Enhanced rotation AI to face towards player"""
         player_pos = self.tank.pos
@@ -794,37 +2273,85 @@ class Tanks():
         # Choose best direction to face player
         if abs(dx) > abs(dy):
             # Face horizontally
-            target_direction = Dot(1 if dx > 0 else -1, 0)
+            target_direction = RIGHT if dx > 0 else LEFT
         else:
             # Face vertically
-            target_direction = Dot(0, 1 if dy > 0 else -1)
+            target_direction = DOWN if dy > 0 else UP
         
         # Rotate towards target direction
         if tank.direction != target_direction:
             tank.rotate(target_direction)
         else:
             # Already facing player, occasionally rotate randomly for unpredictability
-            if random.randrange(4) == 0:
-                direction = random.choice(tank.rotations)
+            if rng.randrange(4) == 0:
+                direction = rng.choice(tank.rotations)
                 tank.rotate(direction)
 
     def remove_tank(self, tank: Tank):
-        self.screen.draw(tank.pos.x, tank.pos.y, tank.figure, BLACK_IDX)
-
-    def draw_missiles(self, missiles):
-        for m in missiles:
-            if m.visible():
-                self.screen.set(m.pos.x, m.pos.y, RED_IDX)
+        self.layers.draw(tank.pos.x, tank.pos.y, tank.figure, BLACK_IDX)
+
+    def draw_missiles(self, missiles: EntityPool):
+        missiles.draw(self.layers, RED_IDX)
+
+    def stamp_tanks(self):
+        """
+        Mark the 3x3 box of every tank in owners, so a missile hit is one
+        lookup. Where enemies overlap the first one in the list owns the cell.
+        """
+        owners = self.owners
+        owners[:] = ZEROS
+        self.stamp(self.tank, Tanks.PLAYER)
+        for idx in range(len(self.enemies)):
+            self.stamp(self.enemies[idx], idx + 1)
+
+    def stamp(self, tank: Tank, owner: int):
+        owners = self.owners
+        x = tank.pos.x
+        y = tank.pos.y
+        for row in range(max(y, 0), min(y + 3, SCREEN_HEIGHT)):
+            for col in range(max(x, 0), min(x + 3, SCREEN_WIDTH)):
+                cell = row * SCREEN_WIDTH + col
+                if owner == Tanks.PLAYER or not owners[cell] & Tanks.ENEMY:
+                    owners[cell] |= owner
+
+    def resolve_hits(self):
+        """Player missiles hit enemies and enemy missiles hit the player"""
+        owners = self.owners
+        missiles = self.tank.missiles
+        idx = 0
+        while idx < missiles.count:
+            owner = owners[missiles.y[idx] * SCREEN_WIDTH + missiles.x[idx]] & Tanks.ENEMY
+            if owner:
+                self.enemies[owner - 1].lives -= 1
+                missiles.remove(idx)
+            else:
+                idx += 1
+
+        for e in self.enemies:
+            missiles = e.missiles
+            idx = 0
+            while idx < missiles.count:
+                if owners[missiles.y[idx] * SCREEN_WIDTH + missiles.x[idx]] & Tanks.PLAYER:
+                    self.tank.lives -= 1
+                    missiles.remove(idx)
+                else:
+                    idx += 1
 
     def draw_tank(self, tank: Tank):
         if tank.is_dead():
             return
 
-        self.screen.draw(tank.pos.x, tank.pos.y, tank.figure)
+        self.layers.draw(tank.pos.x, tank.pos.y, tank.figure)
         if tank.lives <= 0:
             tank.lives -= 1
             if tank.lives % 6 == 0:
-                self.screen.draw(tank.pos.x, tank.pos.y, self.explosion)
+                self.layers.draw(tank.pos.x, tank.pos.y, self.explosion)
+
+    def spawn_used(self, idx: int) -> bool:
+        for e in self.enemies:
+            if e.origin == idx:
+                return True
+        return False
 
     def remove_dead_enemies(self) -> int:
         left = 0
@@ -841,35 +2368,53 @@ class Tanks():
 
         return count
 
-    def draw_score(self):
+    def draw_hud(self):
         self.score %= 100
         self.speed = self.score // 10
-        self.screen.draw(0, 0, figures.DIGITS[self.speed])
-        self.screen.draw(4, 0, figures.DIGITS[self.score % 10])
-        self.screen.draw(0, 5, HLINE)
+        lives = max(0, self.tank.lives)
+        if self.score == self.shown_score and lives == self.shown_lives:
+            return
+        self.shown_score = self.score
+        self.shown_lives = lives
+        self.hud.clear()
+        self.draw_score()
+        self.draw_lives()
+        self.layers.invalidate(self.hud, 0, HUD_HEIGHT)
+
+    def draw_score(self):
+        self.hud.draw(0, 0, figures.DIGITS[self.speed])
+        self.hud.draw(4, 0, figures.DIGITS[self.score % 10])
+        self.hud.draw(0, 5, HLINE)
 
     def draw_lives(self):
         y = 5
         x = 0
         for _ in range(self.tank.lives):
-            self.screen.set(x, y, LIGHT_BLUE_IDX)
+            self.hud.set(x, y, LIGHT_BLUE_IDX)
             x += 2
 
     def game_over(self):
         while not joy.was_pressed():
-            x = random.randrange(SCREEN_WIDTH)
-            y = random.randrange(6, SCREEN_HEIGHT)
-            color = random.choice(range(len(COLORS)))
+            x = rng.randrange(SCREEN_WIDTH)
+            y = rng.randrange(6, SCREEN_HEIGHT)
+            color = rng.choice(range(len(COLORS)))
             self.screen.set(x, y, color)
             self.screen.render()
             time.sleep_ms(50)
             
 
 
-class Races():
-    def __init__(self):
-        self.screen = FrameBuffer()
-        self.road = FrameBuffer.from_rows((
+class Races(Game):
+    PERIOD_MS = 20
+    OBSTACLES = 8
+    BULLETS = 16
+
+    def __init__(self, display=None):
+        super().__init__(display)
+        # The road is a ring of rows, screen row y shows ring row
+        # y - scrolled. Only the visible road, what the car runs into and
+        # the layers compose, is copied out of it.
+        self.ring = FrameBuffer.from_rows((
             0o_33000333000333000333000333000333,   #
             0o_00000000000000000000000000000000,   #  7^
             0o_00000000000000000000000000000000,   #   |
@@ -878,7 +2423,14 @@ class Races():
             0o_00000000000000000000000000000000,   #  0+---->
             0o_00000000000000000000000000000000,   #   0 y  31
             0o_33000333000333000333000333000333,   #
-        ))
+        )).content
+        self.scrolled = 0
+        self.road = FrameBuffer()
+        self.road.content[:] = self.ring
+        self.hud = FrameBuffer()
+        self.layers = Layers(self.screen, self.road, self.hud)
+        self.shown_score = None
+        self.shown_lives = None
         self.car = Figure(bytearray(
             b"\0\3\0"
             b"\3\3\3"
@@ -890,8 +2442,9 @@ class Races():
         # New features
         self.lives = 3
         self.score = 0
-        self.obstacles = []  # List of obstacle positions
-        self.bullets = []    # List of bullet positions
+        # Obstacles lie on the road, y[i] + scrolled is their screen row
+        self.obstacles = EntityPool(Races.OBSTACLES)
+        self.bullets = EntityPool(Races.BULLETS)
         self.obstacle_spawn_counter = 0
         self.invulnerable_time = 0  # Invulnerability frames after hit
         
@@ -902,166 +2455,163 @@ class Races():
             b"\2\2\2"
         ), width=3)
 
-    def run(self):
-        step = 5
-        pos = Dot(3, 27)
+        self.scroll_step = 5
+        self.pos = Dot(3, 27)
 
-        while True:
-            # Handle input
-            x = joy.read_x()
-            y = joy.read_y()
-            if x and y:
-                y = 0
-
-            # Move car
-            new_pos = Dot(pos.x + x, pos.y + y)
-            if not self.road.collides(new_pos.x, new_pos.y, self.car):
-                pos = new_pos
-
-            # Shooting
-            if joy.was_pressed():
-                self.bullets.append(Dot(pos.x + 1, pos.y - 1))  # Shoot from car center
-
-            # Update game state
-            self.update_bullets()
-            self.update_obstacles()
-            self.check_collisions(pos)
-            
-            # Draw everything
-            self.screen.copy_from(self.road)
-            self.draw_obstacles()
-            self.draw_bullets()
-            
-            # Draw car (flash if invulnerable)
-            if self.invulnerable_time <= 0 or self.invulnerable_time % 4 < 2:
-                self.screen.draw(pos.x, pos.y, self.car)
-            
-            self.draw_ui()
-            self.screen.render()
+    def step(self, inputs) -> bool:
+        # Handle input
+        x = inputs.read_x()
+        y = inputs.read_y()
+        if x and y:
+            y = 0
 
-            # Check game over
-            if self.lives <= 0:
-                self.game_over()
-                return
+        # Move car
+        pos = self.pos
+        if not self.road.collides(pos.x + x, pos.y + y, self.car):
+            pos.set_xy(pos.x + x, pos.y + y)
 
-            # Scroll road and spawn obstacles
-            if step >= 5:
-                step = 0
-                self.scroll_road()
-                self.spawn_obstacles()
+        # Shooting
+        if inputs.was_pressed():
+            self.bullets.add(pos.x + 1, pos.y - 1, dy=-2)  # Shoot from car center, bullets move up fast
 
-            # Update counters
-            if self.invulnerable_time > 0:
-                self.invulnerable_time -= 1
-            step += 1
-            time.sleep_ms(20)
+        # Update game state
+        self.update_bullets()
+        self.update_obstacles()
+        self.check_collisions(pos)
+        
+        # Draw everything
+        self.draw_ui()
+        self.layers.begin()
+        self.draw_obstacles()
+        self.draw_bullets()
+        
+        # Draw car (flash if invulnerable)
+        if self.invulnerable_time <= 0 or self.invulnerable_time % 4 < 2:
+            self.layers.draw(pos.x, pos.y, self.car)
+        # Score and lives stay on top of whatever passes under them
+        self.layers.overlay(self.hud, 0, HUD_HEIGHT)
+        
+        self.show()
+
+        # Check game over
+        if self.lives <= 0:
+            return False
+
+        # Scroll road and spawn obstacles
+        if self.scroll_step >= 5:
+            self.scroll_step = 0
+            self.scroll_road()
+            self.spawn_obstacles()
+
+        # Update counters
+        if self.invulnerable_time > 0:
+            self.invulnerable_time -= 1
+        self.scroll_step += 1
+        return True
 
     def scroll_road(self):
-        """Scroll the road and move obstacles"""
-        left_pixel = self.road.get(0, SCREEN_HEIGHT-1)
-        right_pixel = self.road.get(SCREEN_WIDTH - 1, SCREEN_HEIGHT-1)
-        self.road.shift_right(1)
-        self.road.set(0, 0, left_pixel)
-        self.road.set(SCREEN_WIDTH - 1, 0, right_pixel)
+        """Scroll the road, and the obstacles on it, one row down"""
+        self.scrolled += 1
+        if self.scrolled == SCREEN_HEIGHT:
+            # The ring went round, keep obstacle rows small
+            self.scrolled = 0
+            self.obstacles.shift(0, SCREEN_HEIGHT)
+
+        # The bottom rows of the ring come first on screen
+        split = (SCREEN_HEIGHT - self.scrolled) * SCREEN_WIDTH
+        road = self.road.content
+        road[:SCREEN_SIZE - split] = self.ring[split:]
+        road[SCREEN_SIZE - split:] = self.ring[:split]
+        self.layers.invalidate(self.road)
         
-        # Move obstacles down
-        for obstacle in self.obstacles:
-            obstacle.y += 1
-        
-        # Remove obstacles that are off screen
-        self.obstacles = [obs for obs in self.obstacles if obs.y < SCREEN_HEIGHT]
+        # Remove obstacles off screen
+        self.obstacles.cull(self.scrolled)
 
     def spawn_obstacles(self):
         """Randomly spawn obstacles at the top of the screen"""
         self.obstacle_spawn_counter += 1
         
         # Spawn obstacle every 15-30 steps randomly
-        if self.obstacle_spawn_counter >= random.randrange(15, 31):
+        if self.obstacle_spawn_counter >= rng.randrange(15, 31):
             self.obstacle_spawn_counter = 0
             
             # Choose random lane (avoid road edges)
-            lanes = [1, 2, 3, 4, 5, 6]  # Valid lanes for 3-wide obstacles
-            lane = random.choice(lanes)
+            lane = rng.randrange(1, 7)  # Valid lanes for 3-wide obstacles
             
             # Make sure obstacle doesn't overlap with existing ones
+            obstacles = self.obstacles
             can_spawn = True
-            for existing in self.obstacles:
-                if existing.y < 10 and abs(existing.x - lane) < 4:  # Too close
+            for idx in range(obstacles.count):
+                if obstacles.y[idx] + self.scrolled < 10 and abs(obstacles.x[idx] - lane) < 4:  # Too close
                     can_spawn = False
                     break
             
             if can_spawn:
-                self.obstacles.append(Dot(lane, 0))
+                obstacles.add(lane, -self.scrolled)
 
     def update_bullets(self):
         """Update bullet positions and remove off-screen bullets"""
-        for bullet in self.bullets:
-            bullet.y -= 2  # Bullets move up fast
-        
-        # Remove bullets that are off screen
-        self.bullets = [bullet for bullet in self.bullets if bullet.y >= 0]
+        self.bullets.move()
+        self.bullets.cull()
 
     def update_obstacles(self):
         """Handle bullet-obstacle collisions"""
-        bullets_to_remove = []
-        obstacles_to_remove = []
-        
-        for i, bullet in enumerate(self.bullets):
-            for j, obstacle in enumerate(self.obstacles):
+        bullets = self.bullets
+        obstacles = self.obstacles
+        # Obstacle centers on screen are one row lower than their road rows
+        center = self.scrolled + 1
+        for i in range(bullets.count):
+            for j in range(obstacles.count):
                 # Check if bullet hits obstacle
-                if (abs(bullet.x - (obstacle.x + 1)) <= 1 and
-                    abs(bullet.y - (obstacle.y + 1)) <= 1):
-                    bullets_to_remove.append(i)
-                    obstacles_to_remove.append(j)
+                if (abs(bullets.x[i] - (obstacles.x[j] + 1)) <= 1 and
+                    abs(bullets.y[i] - (obstacles.y[j] + center)) <= 1):
+                    bullets.kill(i)
+                    obstacles.kill(j)
                     self.score += 10  # Points for destroying obstacle
         
-        # Remove hit bullets and obstacles (in reverse order to maintain indices)
-        for i in sorted(bullets_to_remove, reverse=True):
-            if i < len(self.bullets):
-                del self.bullets[i]
-        for j in sorted(obstacles_to_remove, reverse=True):
-            if j < len(self.obstacles):
-                del self.obstacles[j]
+        # Remove hit bullets and obstacles once no loop needs their indexes
+        bullets.sweep()
+        obstacles.sweep()
 
     def check_collisions(self, car_pos):
         """Check if car collides with obstacles"""
         if self.invulnerable_time > 0:
             return  # Car is invulnerable
         
-        car_center = Dot(car_pos.x + 1, car_pos.y + 2)  # Car center
-        
-        for obstacle in self.obstacles:
-            obstacle_center = Dot(obstacle.x + 1, obstacle.y + 1)
-            
-            # Check collision (simple distance check)
-            if (abs(car_center.x - obstacle_center.x) <= 2 and
-                abs(car_center.y - obstacle_center.y) <= 3):
+        obstacles = self.obstacles
+        for idx in range(obstacles.count):
+            # Check collision (simple distance check) between the centers,
+            # the car's is one lower than the obstacle's
+            if (abs(car_pos.x - obstacles.x[idx]) <= 2 and
+                abs(car_pos.y + 1 - (obstacles.y[idx] + self.scrolled)) <= 3):
                 self.lives -= 1
                 self.invulnerable_time = 60  # 3 seconds of invulnerability at 50ms per frame
                 break
 
     def draw_obstacles(self):
         """Draw all obstacles on screen"""
-        for obstacle in self.obstacles:
-            if 0 <= obstacle.y < SCREEN_HEIGHT - 2:  # Make sure obstacle fits on screen
-                self.screen.draw(obstacle.x, obstacle.y, self.obstacle)
+        self.obstacles.draw(self.layers, None, self.obstacle, self.scrolled)
 
     def draw_bullets(self):
         """Draw all bullets on screen"""
-        for bullet in self.bullets:
-            if 0 <= bullet.y < SCREEN_HEIGHT:
-                self.screen.set(bullet.x, bullet.y, YELLOW_IDX)
+        self.bullets.draw(self.layers, YELLOW_IDX)
 
     def draw_ui(self):
         """Draw score and lives"""
         # Draw score (top left and right)
         score_display = min(99, self.score // 10)  # Show score/10, max 99
-        self.screen.draw(0, 0, figures.DIGITS[score_display // 10])
-        self.screen.draw(4, 0, figures.DIGITS[score_display % 10])
+        if score_display == self.shown_score and self.lives == self.shown_lives:
+            return
+        self.shown_score = score_display
+        self.shown_lives = self.lives
+        self.hud.clear()
+        self.hud.draw(0, 0, figures.DIGITS[score_display // 10])
+        self.hud.draw(4, 0, figures.DIGITS[score_display % 10])
         
         # Draw lives (between score digits, as small dots)
         for i in range(min(3, self.lives)):  # Show max 3 lives
-            self.screen.set(3, 1 + i, LIGHT_BLUE_IDX)  # Vertical stack between digits
+            self.hud.set(3, 1 + i, LIGHT_BLUE_IDX)  # Vertical stack between digits
+        self.layers.invalidate(self.hud, 0, HUD_HEIGHT)
 
     def game_over(self):
         """Game over animation"""
@@ -1070,7 +2620,7 @@ class Races():
             for color_idx in range(1, len(COLORS)):
                 for x in range(SCREEN_WIDTH):
                     for y in range(6, SCREEN_HEIGHT):
-                        if random.randrange(3) == 0:  # Random flashing
+                        if rng.randrange(3) == 0:  # Random flashing
                             self.screen.set(x, y, color_idx)
                 
                 self.screen.render()
@@ -1085,96 +2635,156 @@ class Races():
                 time.sleep_ms(400)
 
 
-class Snake():
-
-    def __init__(self):
-        self.body = [Dot(4, 15), Dot(4, 16), Dot(4, 17)]
+class Snake(Game):
+    """
+    The body is a ring of cell indexes, y * SCREEN_WIDTH + x, from the tail
+    to the head, and occupied is a bitmap of the cells on it, so moving,
+    growing and running into itself take the same time at any length. The
+    cells off the body are the first free_count entries of free, and where
+    holds the position of each of them in free, so an apple lands on a free
+    cell with a single draw. The screen is kept between moves: a move
+    repaints the head, the neck and the cell the tail left, which stays dark
+    green until the next move.
+    """
+    PERIOD_MS = 20
+
+    def __init__(self, display=None):
+        super().__init__(display)
+        self.cells = bytearray(SCREEN_SIZE)
+        self.occupied = bytearray(SCREEN_SIZE // 8)
+        self.free = bytearray(range(SCREEN_SIZE))
+        self.where = bytearray(range(SCREEN_SIZE))
+        self.free_count = SCREEN_SIZE
+        self.tail = 0
+        self.length = 0
+        self.vacated = -1
+        for y in (15, 16, 17):
+            self.grow(y * SCREEN_WIDTH + 4)
         self.direction = Dot(0, 1)
-        self.apple = Dot(5, 5)
-        self.screen = FrameBuffer()
+        self.apple = 5 * SCREEN_WIDTH + 5
+        self.move_step = 30
+        self.draw_snake()
+
+
+    def step(self, inputs) -> bool:
+        new_x = inputs.read_x()
+        new_y = inputs.read_y()
+        if new_x and new_y:
+            new_x = 0
+        speedup = 1
+
+        direction = self.direction
+        if (new_x or new_y) and not (direction.x + new_x == 0 and direction.y + new_y == 0):
+            direction.set_xy(new_x, new_y)
+            speedup = 5
+
+        if self.move_step >= 30:
+            self.move_step = 0
+
+            if self.vacated >= 0:
+                self.screen.content[self.vacated] = BLACK_IDX
+                self.vacated = -1
+            self.respawn_apple()
+            if not self.move_forward():
+                return False
 
+            # The snake only moves every few ticks, never skip showing it
+            self.display(self.screen)
 
-    def run(self):
-        step = 30
-        while True:
-            new_x = joy.read_x()
-            new_y = joy.read_y()
-            if new_x and new_y:
-                new_x = 0
-            direction = Dot(new_x, new_y)
-            speedup = 1
+        self.move_step += 1*speedup
+        return True
 
-            if not (direction.is_zero() or self.direction.is_opposite(direction)):
-                self.direction.set(direction)
-                speedup = 5 if self.direction == direction else 1
+    def is_occupied(self, cell: int) -> bool:
+        return self.occupied[cell >> 3] & (1 << (cell & 7))
 
-            if step >= 30:
-                step = 0
+    def head(self) -> int:
+        return self.cells[(self.tail + self.length - 1) % SCREEN_SIZE]
 
-                self.screen.clear()
-                self.draw_snake(DARK_GREEN_IDX)
-                self.respawn_apple()
-                if not self.move_forward():
-                    self.game_over()
-                    return
-                self.draw_snake()
+    def grow(self, cell: int):
+        self.cells[(self.tail + self.length) % SCREEN_SIZE] = cell
+        self.length += 1
+        self.occupied[cell >> 3] |= 1 << (cell & 7)
 
-                self.screen.render()
+        # Swap the last free cell into its place
+        self.free_count -= 1
+        last = self.free[self.free_count]
+        pos = self.where[cell]
+        self.free[pos] = last
+        self.where[last] = pos
 
-            step += 1*speedup
-            time.sleep_ms(20)
+    def shrink(self) -> int:
+        cell = self.cells[self.tail]
+        self.tail = (self.tail + 1) % SCREEN_SIZE
+        self.length -= 1
+        self.occupied[cell >> 3] &= ~(1 << (cell & 7))
+
+        self.free[self.free_count] = cell
+        self.where[cell] = self.free_count
+        self.free_count += 1
+        return cell
 
     def respawn_apple(self):
-        if self.apple is None:
-            x = random.randrange(SCREEN_WIDTH)
-            y = random.randrange(SCREEN_HEIGHT)
-            if self.screen.get(x, y) == BLACK_IDX:
-                self.apple = Dot(x, y)
-
-        if self.apple:
-            self.screen.set(self.apple.x, self.apple.y, RED_IDX)
-
-    def move_forward(self):
-        head_idx = len(self.body)-1
-        dot = self.body[head_idx].move_wrap(self.direction)
-
-        color = self.screen.get(dot.x, dot.y)
-        no_collision = color == 0 and dot not in self.body
-        if not no_collision:
-            if color == RED_IDX: 
-                self.body.append(dot)
-                self.apple = None
-                return True # Eat the apple
-
-        for idx in range(len(self.body) - 1):
-            self.body[idx] = self.body[idx+1]
-        self.body[head_idx] = dot
-
-        return no_collision
+        if self.apple < 0 and self.free_count:
+            self.apple = self.free[rng.randrange(self.free_count)]
+
+        if self.apple >= 0:
+            self.screen.content[self.apple] = RED_IDX
+
+    def move_forward(self) -> bool:
+        neck = self.head()
+        x = (neck % SCREEN_WIDTH + self.direction.x) % SCREEN_WIDTH
+        y = (neck // SCREEN_WIDTH + self.direction.y) % SCREEN_HEIGHT
+        head = y * SCREEN_WIDTH + x
+        content = self.screen.content
+
+        if head == self.apple:
+            # Eat the apple, the tail stays where it is
+            self.grow(head)
+            self.apple = -1
+        else:
+            collision = self.is_occupied(head)
+            self.vacated = self.shrink()
+            content[self.vacated] = DARK_GREEN_IDX
+            if collision:
+                self.cells[(self.tail + self.length) % SCREEN_SIZE] = head
+                self.length += 1
+                return False
+            self.grow(head)
+
+        content[neck] = GREEN_IDX
+        content[head] = LIGHT_GREEN_IDX
+        return True
     
     def draw_snake(self, color=GREEN_IDX):
-        for dot in self.body:
-            self.screen.set(dot.x, dot.y, color)
-        head = self.body[-1]
-        self.screen.set(head.x, head.y, LIGHT_GREEN_IDX)
+        content = self.screen.content
+        for idx in range(self.length):
+            content[self.cells[(self.tail + idx) % SCREEN_SIZE]] = color
+        content[self.head()] = LIGHT_GREEN_IDX
 
     def game_over(self):
         self.draw_snake(color=BRICK_IDX)
         color = 0
         while not joy.was_pressed():
-            self.screen.set(self.apple.x, self.apple.y, color)
+            if self.apple >= 0:
+                self.screen.content[self.apple] = color
             self.screen.render()
             color = (color + 1) % len(COLORS)
             time.sleep_ms(200)
 
-class Live():
+class Live(Game):
 
-    def __init__(self):
-        self.screen = FrameBuffer()
+    def __init__(self, display=None):
+        super().__init__(display)
         self.next_screen = FrameBuffer()
+        self.hud = FrameBuffer()
+        self.shown_pattern = None
+        self.shown_generation = None
+        self.shown_paused = None
         self.generation = 0
         self.paused = False
         self.pattern_index = 0
+        self.generation_step = 0
+        self.speed = 20  # Steps between generations (lower = faster)
         
         # Define some classic Conway patterns
         self.patterns = [
@@ -1195,12 +2805,10 @@ class Live():
         # Initialize with first pattern
         self.set_pattern()
 
-    def run(self):
-        self.play_live()
-    
     def set_pattern(self):
         """Set the current pattern on the grid"""
         self.screen.clear()
+        self.shown_pattern = None
         self.generation = 0
         
         current_pattern = self.patterns[self.pattern_index]
@@ -1208,7 +2816,7 @@ class Live():
             # Random pattern
             for x in range(SCREEN_WIDTH):
                 for y in range(6, SCREEN_HEIGHT):  # Skip top area for UI
-                    if random.randrange(4) == 0:  # 25% chance of being alive
+                    if rng.randrange(4) == 0:  # 25% chance of being alive
                         self.screen.set(x, y, GREEN_IDX)
         else:
             # Predefined pattern
@@ -1249,12 +2857,9 @@ class Live():
     
     def next_generation(self):
         """Calculate next generation based on Conway's rules"""
-        self.next_screen.clear()
-        
         # Copy UI area
-        for x in range(SCREEN_WIDTH):
-            for y in range(6):
-                self.next_screen.set(x, y, self.screen.get(x, y))
+        self.next_screen.view(0, HUD_HEIGHT * SCREEN_WIDTH)[:] = self.screen.view(0, HUD_HEIGHT * SCREEN_WIDTH)
+        self.next_screen.clear(_from=HUD_HEIGHT * SCREEN_WIDTH)
         
         # Apply Conway's rules to game area
         for x in range(SCREEN_WIDTH):
@@ -1278,58 +2883,62 @@ class Live():
     
     def draw_ui(self):
         """Draw pattern indicator and controls info"""
-        # Display pattern number (0-5)
-        self.screen.draw(0, 0, figures.DIGITS[self.pattern_index])
-        
         # Show generation indicator (simplified)
         gen_indicator = min(9, self.generation // 10)  # Show progress as single digit
-        self.screen.draw(4, 0, figures.DIGITS[gen_indicator])
+
+        # The UI area is carried over between generations, so it only
+        # needs to be redrawn when something on it changes
+        if (self.pattern_index == self.shown_pattern
+                and gen_indicator == self.shown_generation
+                and self.paused == self.shown_paused):
+            return
+        self.shown_pattern = self.pattern_index
+        self.shown_generation = gen_indicator
+        self.shown_paused = self.paused
+        self.hud.clear()
+
+        # Display pattern number (0-5)
+        self.hud.draw(0, 0, figures.DIGITS[self.pattern_index])
+        self.hud.draw(4, 0, figures.DIGITS[gen_indicator])
         
-        self.screen.draw(0, 5, HLINE)
+        self.hud.draw(0, 5, HLINE)
         
         # Show pause indicator
         if self.paused:
             # Draw pause symbol (two vertical lines)
-            self.screen.set(6, 1, YELLOW_IDX)
-            self.screen.set(6, 2, YELLOW_IDX)
-            self.screen.set(6, 3, YELLOW_IDX)
-            self.screen.set(7, 1, YELLOW_IDX)
-            self.screen.set(7, 2, YELLOW_IDX)
-            self.screen.set(7, 3, YELLOW_IDX)
+            self.hud.fill(6, 1, 2, 3, YELLOW_IDX)
+
+        self.screen.view(0, HUD_HEIGHT * SCREEN_WIDTH)[:] = self.hud.view(0, HUD_HEIGHT * SCREEN_WIDTH)
     
-    def play_live(self):
-        """Main Game of Life loop"""
-        step = 0
-        speed = 20  # Steps between generations (lower = faster)
+    def step(self, inputs) -> bool:
+        """One tick of the Game of Life, it never ends"""
+        # Handle input
+        if inputs.was_pressed():
+            self.paused = not self.paused
         
-        while True:
-            # Handle input
-            if joy.was_pressed():
-                self.paused = not self.paused
-            
-            # Cycle through patterns
-            if joy.was_pressed_x():
-                self.next_pattern()
-                self.paused = False
-            
-            # Speed control with joystick Y
-            speed_change = joy.was_pressed_y()
-            if speed_change > 0:
-                speed = min(50, speed + 5)  # Slower
-            elif speed_change < 0:
-                speed = max(5, speed - 5)   # Faster
-            
-            # Update generation
-            if not self.paused and step >= speed:
-                self.next_generation()
-                step = 0
-            
-            # Draw everything
-            self.draw_ui()
-            self.screen.render()
-            
-            step += 1
-            time.sleep_ms(50)
+        # Cycle through patterns
+        if inputs.was_pressed_x():
+            self.next_pattern()
+            self.paused = False
+        
+        # Speed control with joystick Y
+        speed_change = inputs.was_pressed_y()
+        if speed_change > 0:
+            self.speed = min(50, self.speed + 5)  # Slower
+        elif speed_change < 0:
+            self.speed = max(5, self.speed - 5)   # Faster
+        
+        # Update generation
+        if not self.paused and self.generation_step >= self.speed:
+            self.next_generation()
+            self.generation_step = 0
+        
+        # Draw everything
+        self.draw_ui()
+        self.show()
+        
+        self.generation_step += 1
+        return True
 
 
 GAMES = [
@@ -1401,14 +3010,62 @@ GAMES = [
 ]
 
 
+# Set to True to record the input of every game into RECORD_FILE, see
+# InputRecorder and replay.py
+RECORD = False
+RECORD_FILE = "session.rec"
+# Set to True to capture the frames of every game into CAPTURE_FILE, see
+# FrameRecorder and capture.py
+CAPTURE = False
+CAPTURE_FILE = "frames.cap"
+
+
+def play(idx: int):
+    game = GAMES[idx][1]
+    frames = None
+    if CAPTURE:
+        frames = FrameRecorder(open(CAPTURE_FILE, "wb"))
+        frames.enable()
+    # A new sequence every session, the press comes at a different
+    # microsecond each time. Only headless runs and replays pick the seed.
+    seed = time.ticks_us() & 0xFFFF
+    rng.seed(seed)
+    try:
+        if not RECORD:
+            game().run()
+            return
+
+        with open(RECORD_FILE, "wb") as stream:
+            recorder = InputRecorder(joy, stream, idx, seed)
+            try:
+                game().run(recorder)
+            finally:
+                recorder.close()
+    finally:
+        if frames:
+            frames.disable()
+            frames.stream.close()
+            print(frames.stats())
+
+
 def main():
+    # The worker first, so the profiler leaves the LED writes of its thread alone
+    if OFFLOAD:
+        renderer.start()
+    if PROFILE:
+        profiler.enable()
+
     idx = 0
+    clock = Clock(100)
     while True:
         next = joy.was_pressed_x()
         idx = (idx + next) % len(GAMES)
         if joy.was_pressed():
-            GAMES[idx][1]().run()
+            play(idx)
+            clock = Clock(100)
         FrameBuffer.from_rows(GAMES[idx][0]).render()
-        time.sleep_ms(100)
+        joy.end_tick()
+        clock.tick()
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Tests for the rp2040bit FrameBuffer
+"""
+
+import inspect
+import random
+
+import figures
+from harness import load_game, VirtualTime
+
+game = load_game()
+FrameBuffer = game.FrameBuffer
+
+
+def test_render_skips_unchanged_frames():
+    """A frame identical to the one on the LEDs must not be pushed again"""
+    FrameBuffer.invalidate()
+    buf = FrameBuffer()
+    buf.render()
+
+    writes = game.np.writes
+    skipped = FrameBuffer.writes_skipped
+    buf.render()
+    assert game.np.writes == writes
+    assert FrameBuffer.writes_skipped == skipped + 1
+
+
+def test_render_pushes_only_changed_pixels():
+    FrameBuffer.invalidate()
+    buf = FrameBuffer()
+    buf.render()
+
+    changed = FrameBuffer.pixels_changed
+    buf.set(2, 7, game.RED_IDX)
+    buf.set(5, 8, game.BLUE_IDX)
+    buf.render()
+    assert FrameBuffer.pixels_changed == changed + 2
+
+
+def test_render_matches_serpentine_wiring():
+    """The wire buffer must hold every color at its serpentine LED offset"""
+    FrameBuffer.invalidate()
+    buf = FrameBuffer()
+    for idx in range(game.SCREEN_SIZE):
+        buf.content[idx] = idx % len(game.COLORS)
+    buf.render()
+
+    for y in range(game.SCREEN_HEIGHT):
+        for x in range(game.SCREEN_WIDTH):
+            led = game.SCREEN_WIDTH * y + (7 - x if y % 2 == 0 else x)
+            assert game.np[led] == game.COLORS[buf.get(x, y)]
+
+
+def test_layers_restore_sprite_rows_from_base():
+    screen = FrameBuffer()
+    ground = FrameBuffer()
+    hud = FrameBuffer()
+    ground.set(0, 20, game.BRICK_IDX)
+    hud.set(1, 0, game.PINK_IDX)
+    layers = game.Layers(screen, ground, hud)
+
+    layers.begin()
+    layers.draw(0, 18, game.HLINE)
+    assert screen.get(3, 18) == 6
+    layers.begin()
+    assert screen.get(3, 18) == game.BLACK_IDX
+    assert screen.get(0, 20) == game.BRICK_IDX
+    assert screen.get(1, 0) == game.PINK_IDX
+    assert layers.composed == 1
+
+    # A sprite over the HUD rows goes under the HUD again
+    layers.draw(0, 0, game.HLINE)
+    layers.overlay(hud, 0, game.HUD_HEIGHT)
+    assert screen.get(1, 0) == game.PINK_IDX
+    assert screen.get(2, 0) == 6
+    layers.begin()
+
+    ground.set(7, 31, game.RED_IDX)
+    layers.invalidate()
+    layers.begin()
+    assert screen.get(7, 31) == game.RED_IDX
+    assert layers.composed == 2
+
+
+def test_layers_compose_only_the_rows_that_changed():
+    screen = FrameBuffer()
+    ground = FrameBuffer()
+    hud = FrameBuffer()
+    for y in range(game.SCREEN_HEIGHT):
+        ground.set(y % game.SCREEN_WIDTH, y, game.BRICK_IDX)
+    hud.draw(0, 0, figures.DIGITS[8])
+    layers = game.Layers(screen, ground, hud)
+    layers.begin()
+    merged = layers.top_merged
+
+    # The first layer alone: the upper ones are not merged again
+    ground.scroll(1)
+    layers.invalidate(ground)
+    layers.begin()
+    assert layers.top_merged == merged
+    expected = FrameBuffer(bytearray(ground.content))
+    expected.draw(0, 0, figures.DIGITS[8])
+    assert screen.equals(expected)
+
+    hud.clear()
+    hud.set(7, 2, game.PINK_IDX)
+    layers.invalidate(hud, 0, game.HUD_HEIGHT)
+    layers.begin()
+    assert layers.top_merged == merged + game.HUD_HEIGHT
+    assert (layers.upper_first, layers.upper_last) == (2, 3)
+    assert screen.get(7, 2) == game.PINK_IDX
+    assert screen.get(0, 0) == ground.get(0, 0)
+
+
+def test_bitboard_collides_like_framebuffer():
+    random.seed(4)
+    buf = FrameBuffer()
+    well = game.Bitboard()
+    for _ in range(60):
+        x = random.randrange(game.SCREEN_WIDTH)
+        y = random.randrange(game.SCREEN_HEIGHT)
+        buf.set(x, y, game.BRICK_IDX)
+        well.rows[y] |= 1 << x
+
+    shapes = []
+    for shape in figures.TETRAMINO:
+        for _ in range(4):
+            shapes.append(shape)
+            shape = shape.rotate()
+    for shape in shapes:
+        for y in range(-4, game.SCREEN_HEIGHT + 2):
+            for x in range(-5, game.SCREEN_WIDTH + 2):
+                assert well.collides(x, y, shape) == buf.collides(x, y, shape), (x, y)
+
+
+def test_bitboard_place_marks_full_rows():
+    well = game.Bitboard()
+    bar = game.HLINE
+    well.place(0, 30, bar)
+    assert well.is_full(30)
+    assert well.is_empty(29)
+    well.place(-1, 29, bar)
+    assert well.rows[29] == 0x7F
+
+
+def test_rotations_are_cached_in_a_ring():
+    for shape in figures.TETRAMINO + [figures.TANK]:
+        turned = shape.rotate()
+        assert turned is shape.rotate()
+        assert turned.rotate().rotate().rotate() is shape
+        assert turned.width == shape.height
+        for y in range(shape.height):
+            for x in range(shape.width):
+                assert turned.get(shape.height - 1 - y, x) == shape.get(x, y)
+
+
+def test_bulk_ops():
+    buf = FrameBuffer()
+    buf.fill(-2, 30, 4, 5, game.RED_IDX)
+    assert [buf.get(x, 31) for x in range(3)] == [2, 2, 0]
+    assert buf.get(0, 29) == game.BLACK_IDX
+
+    buf.scroll(-30)
+    assert buf.get(1, 1) == game.RED_IDX
+    assert buf.get(1, 2) == game.BLACK_IDX
+    buf.scroll(2)
+    assert buf.get(1, 3) == game.RED_IDX
+    assert buf.equals(FrameBuffer(), 0, 2 * game.SCREEN_WIDTH)
+    assert not buf.equals(FrameBuffer())
+
+
+def test_draw_clips_to_screen():
+    buf = FrameBuffer()
+    block = figures.TETRAMINO[0]
+    buf.draw(7, 31, block)
+    buf.draw(-1, -1, block)
+    assert buf.get(7, 31) == 1
+    assert buf.get(0, 0) == 1
+    assert sum(buf.content) == 2
+
+
+def test_entity_pool_moves_culls_and_swap_removes():
+    pool = game.EntityPool(4)
+    assert pool.add(0, 0, dx=-1) == 0
+    assert pool.add(3, 1, dy=1, group=2) == 1
+    assert pool.add(5, 31, dy=1) == 2
+    assert pool.add(7, 7) == 3
+    assert pool.add(1, 1) == -1
+
+    pool.move()
+    pool.cull()
+    assert len(pool) == 2
+    assert sorted(zip(pool.x[:2], pool.y[:2])) == [(3, 2), (7, 7)]
+
+    pool.kill(0)
+    pool.sweep()
+    assert len(pool) == 1
+
+    buf = FrameBuffer()
+    pool.draw(buf, game.RED_IDX)
+    assert buf.get(pool.x[0], pool.y[0]) == game.RED_IDX
+    pool.clear()
+    pool.add(6, 29)
+    pool.add(0, 31)
+    pool.draw(buf, None, figures.TETRAMINO[0])
+    assert buf.get(7, 30) == 1
+    assert buf.get(0, 31) == game.BLACK_IDX
+
+
+def test_clock_sleeps_only_the_rest_of_the_frame():
+    real_time = game.time
+    game.time = clock_time = VirtualTime()
+    try:
+        clock = game.Clock(50)
+        for work in (10, 20, 120, 10, 10, 10):
+            clock_time.now += work
+            clock.should_render()
+            clock.tick()
+    finally:
+        game.time = real_time
+
+    # Six frames of 50ms, the 120ms frame is made up by the frames after it
+    assert clock_time.now == 300
+    assert clock.frames == 6
+    assert clock.max_ms == 120
+    assert clock.overruns == 1
+    assert clock.renders_skipped == 1
+
+
+def test_clock_counts_allocations_per_frame():
+    clock = game.Clock(50)
+    clock.allocated = 1000
+    for allocated in (1000, 1000, 1064, 1064, 200, 232):
+        clock.count_alloc(allocated)
+    assert clock.alloc_max == 64
+    assert clock.alloc_last == 32
+    assert clock.alloc_frames == 2
+    assert clock.collections == 1
+
+
+def test_profiler_splits_frames_into_phases():
+    profiler = game.Profiler()
+    profiler.enable()
+    try:
+        buf = FrameBuffer()
+        clock = game.Clock(1)
+        for frame in range(5):
+            game.joy.read_x()
+            game.joy.read_y(up=0, down=10)
+            buf.clear(_from=0, to=game.SCREEN_WIDTH)
+            buf.draw(0, 0, figures.DIGITS[frame], color=frame)
+            buf.render()
+            clock.tick()
+        # Wrappers spell out their arguments, *args and **kwargs allocate
+        for owner, name, _ in profiler.wrapped:
+            code = getattr(owner, name).__code__
+            assert not code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS), name
+    finally:
+        profiler.disable()
+
+    assert profiler.count == 5
+    rows = profiler.report()
+    assert [row[0] for row in rows] == list(game.Profiler.PHASES)
+    for name, low, avg, p95, high in rows:
+        assert 0 <= low <= avg <= high
+        assert low <= p95 <= high
+    idle = rows[game.Profiler.IDLE]
+    assert idle[-1] > 0
+    assert "timed" not in FrameBuffer.draw.__qualname__
+
+
+class HeldPin:
+    """The joystick button held down"""
+
+    def value(self) -> int:
+        return 0
+
+
+def test_profiler_hold_does_not_press_the_button():
+    stick = game.joy
+    button = stick.button
+    stick.button = HeldPin()
+    profiler = game.Profiler()
+    try:
+        assert not profiler.requested()
+        profiler.held_since -= game.Profiler.HOLD_MS + 1
+        assert profiler.requested()
+    finally:
+        stick.button = button
+    # Released after the report
+    stick.debounce_press = -1
+    try:
+        stick.button_callback()
+        assert stick.was_pressed() == 0
+        stick.button_callback()
+        assert stick.was_pressed() == 1
+    finally:
+        stick.debounce_press = 200
+
+
+def test_render_worker_pushes_every_frame_from_its_thread():
+    import threading
+    threads = set()
+    write = game.np.write
+
+    def tracked():
+        threads.add(threading.get_ident())
+        write()
+
+    FrameBuffer.invalidate()
+    game.np.write = tracked
+    worker = game.RenderWorker()
+    worker.start()
+    try:
+        buf = FrameBuffer()
+        for color in range(1, len(game.COLORS)):
+            buf.fill(0, 0, game.SCREEN_WIDTH, game.SCREEN_HEIGHT, color)
+            buf.render()
+        worker.flush()
+        assert worker.rendered == worker.submitted == len(game.COLORS) - 1
+    finally:
+        worker.stop()
+        game.np.write = write
+
+    assert "submit" not in FrameBuffer.render.__code__.co_names
+    assert threads and threading.get_ident() not in threads
+    assert bytes(FrameBuffer.pushed) == bytes(buf.content)
+    assert game.np[0] == game.COLORS[len(game.COLORS) - 1]
+
+
+def test_profiler_leaves_the_render_worker_alone():
+    write = game.np.write
+    renderer = game.renderer
+    renderer.start()
+    profiler = game.Profiler()
+    profiler.enable()
+    try:
+        buf = FrameBuffer()
+        clock = game.Clock(1)
+        for color in range(1, 4):
+            buf.fill(0, 0, game.SCREEN_WIDTH, game.SCREEN_HEIGHT, color)
+            buf.render()
+            clock.tick()
+        renderer.flush()
+        # The LEDs are written from the worker, outside of the phase stack
+        assert game.np.write == write
+        assert profiler.depth == 0
+        assert profiler.count == 3
+    finally:
+        profiler.disable()
+        renderer.stop()
+    assert renderer.rendered == renderer.submitted == 3
+    assert renderer.render_max_us > 0
+
+
+class CountingADC:
+    def __init__(self, value):
+        self.value = value
+        self.reads = 0
+
+    def read_u16(self):
+        self.reads += 1
+        return self.value
+
+
+def test_joystick_samples_once_per_frame():
+    joy = game.Joystick()
+    joy.x_adc = CountingADC(0)
+    joy.y_adc = CountingADC(65535)
+    assert joy.read_x() == 1
+    assert joy.was_pressed_x() == 1
+    assert joy.read_y() == 1
+    assert joy.read_y(up=0, down=10) == 10
+    assert joy.x_adc.reads == joy.y_adc.reads == 1
+
+    joy.end_tick()
+    joy.x_adc.value = game.Joystick.CENTER + 16384
+    assert joy.read_x() == 0
+    joy.end_tick()
+    joy.x_adc.value += 1
+    assert joy.read_x() == -1
+    assert joy.x_adc.reads == 3
+
+
+def test_joystick_menu_presses_repeat_after_release():
+    real_time = game.time
+    game.time = VirtualTime()
+    game.time.now = 1000
+    try:
+        joy = game.Joystick()
+        joy.x_adc = CountingADC(65535)
+        joy.y_adc = CountingADC(game.Joystick.CENTER)
+        presses = []
+        # The menu: was_pressed_x() once per 100ms frame
+        for frame in range(20):
+            if frame == 3:
+                joy.x_adc.value = game.Joystick.CENTER
+            elif frame == 15:
+                joy.x_adc.value = 65535
+            presses.append(joy.was_pressed_x())
+            joy.end_tick()
+            game.time.sleep_ms(100)
+    finally:
+        game.time = real_time
+    assert presses[0] == -1
+    # Released, the stick is quiet until it is pushed again
+    assert presses[4:15] == [0] * 11
+    assert presses[15] == -1
+
+
+def test_game_over_reads_the_stick_afresh():
+    stick = game.joy
+    x_adc = stick.x_adc
+    stick.x_adc = CountingADC(65535)
+
+    class Over(game.Game):
+        def step(self, inputs) -> bool:
+            return inputs.read_x() == 0
+
+        def game_over(self):
+            self.sampled = stick.sampled
+
+    try:
+        over = Over(display=lambda screen: None)
+        over.run()
+        assert not over.sampled
+    finally:
+        stick.x_adc = x_adc
+        stick.end_tick()
+
+
+if __name__ == "__main__":
+    test_render_skips_unchanged_frames()
+    test_render_pushes_only_changed_pixels()
+    test_render_matches_serpentine_wiring()
+    test_layers_restore_sprite_rows_from_base()
+    test_layers_compose_only_the_rows_that_changed()
+    test_bitboard_collides_like_framebuffer()
+    test_bitboard_place_marks_full_rows()
+    test_rotations_are_cached_in_a_ring()
+    test_bulk_ops()
+    test_draw_clips_to_screen()
+    test_entity_pool_moves_culls_and_swap_removes()
+    test_clock_sleeps_only_the_rest_of_the_frame()
+    test_clock_counts_allocations_per_frame()
+    test_profiler_splits_frames_into_phases()
+    test_profiler_hold_does_not_press_the_button()
+    test_render_worker_pushes_every_frame_from_its_thread()
+    test_profiler_leaves_the_render_worker_alone()
+    test_joystick_samples_once_per_frame()
+    test_joystick_menu_presses_repeat_after_release()
+    test_game_over_reads_the_stick_afresh()
+    print("All tests completed!")
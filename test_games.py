@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Soak tests for the games of rp2040bit-main.py, driven headless
+"""
+
+import io
+
+from headless import game, run_headless, RandomInputs, NullDisplay
+from replay import replay
+from capture import FrameReader, first_difference
+
+
+def test_every_game_survives_random_input():
+    for _, game_class in game.GAMES:
+        game.rng.seed(7)
+        display = NullDisplay()
+        result = run_headless(game_class, 3000, RandomInputs(7), display)
+        assert result["ticks"] == 3000
+        assert display.frames > 0, game_class.__name__
+
+
+def test_step_reports_game_over():
+    game.rng.seed(1)
+    snake = game.Snake(display=NullDisplay())
+    inputs = RandomInputs(1)
+    for _ in range(100000):
+        if not snake.step(inputs):
+            break
+    else:
+        assert False, "the snake never crashed"
+
+
+class NullInputs(RandomInputs):
+    """The stick left alone"""
+
+    def direction(self, low, high) -> int:
+        return 0
+
+
+def test_snake_ring_matches_occupancy_bitmap():
+    game.rng.seed(2)
+    snake = game.Snake(display=NullDisplay())
+    # Straight ahead of the head, eaten by the first move
+    snake.apple = 18 * game.SCREEN_WIDTH + 4
+    snake.step(NullInputs())
+    assert snake.length == 4
+
+    inputs = RandomInputs(2)
+    for _ in range(2000):
+        if not snake.step(inputs):
+            break
+        cells = {snake.cells[(snake.tail + idx) % game.SCREEN_SIZE] for idx in range(snake.length)}
+        assert len(cells) == snake.length
+        assert sum(bin(byte).count("1") for byte in snake.occupied) == snake.length
+        assert all(snake.is_occupied(cell) for cell in cells)
+        assert snake.screen.content[snake.head()] == game.LIGHT_GREEN_IDX
+        free = snake.free[:snake.free_count]
+        assert set(free) == set(range(game.SCREEN_SIZE)) - cells
+        assert all(snake.where[cell] == pos for pos, cell in enumerate(free))
+        assert snake.apple not in cells
+
+
+
+def test_flow_field_leads_every_tank_to_the_target():
+    flow = game.FlowField()
+    flow.update(3, 16)
+    flow.update(3, 16)
+    assert flow.searches == 1
+
+    for start in ((0, 6), (5, 6), (0, 29), (5, 29)):
+        x, y = start
+        steps = flow.distance[y * game.SCREEN_WIDTH + x]
+        assert steps == abs(x - 3) + abs(y - 16)
+        direction = game.DOWN
+        for _ in range(steps):
+            direction = flow.next(x, y, direction)
+            x += direction.x
+            y += direction.y
+        assert (x, y) == (3, 16)
+        assert flow.next(x, y, direction) is None
+
+    # Searched a few cells at a time, for the AI scheduler
+    chunked = game.FlowField()
+    chunked.start(3, 16)
+    calls = 1
+    while not chunked.search(8):
+        calls += 1
+    assert calls > 1
+    assert chunked.distance == flow.distance
+
+
+def test_line_of_sight_uses_occupancy_masks():
+    tanks = game.Tanks(display=NullDisplay())
+    player = tanks.tank.pos
+    enemy = game.Tank(game.Dot(player.x, player.y + 9), lives=1, origin=0)
+    tanks.screen.draw(player.x, player.y, tanks.tank.figure)
+    tanks.screen.draw(enemy.pos.x, enemy.pos.y, enemy.figure)
+
+    tanks.update_sight()
+    assert tanks.has_line_of_sight(enemy, player)
+    assert not tanks.has_line_of_sight(game.Tank(game.Dot(0, 29)), player)
+
+    tanks.screen.set(player.x + 1, player.y + 5, game.RED_IDX)
+    tanks.update_sight()
+    assert not tanks.has_line_of_sight(enemy, player)
+    tanks.screen.set(player.x + 1, player.y + 5, game.BLACK_IDX)
+    # Scanned a few rows at a time, for the AI scheduler
+    for first in range(0, game.SCREEN_HEIGHT, 5):
+        tanks.update_sight(first, first + 5)
+    assert tanks.has_line_of_sight(enemy, player)
+    masks = (bytes(tanks.row_masks), list(tanks.col_masks))
+    tanks.update_sight()
+    assert (bytes(tanks.row_masks), list(tanks.col_masks)) == masks
+
+    enemy.rotate(game.UP)
+    assert tanks.can_hit_player(enemy)
+    enemy.rotate(game.DOWN)
+    assert not tanks.can_hit_player(enemy)
+
+
+def test_missiles_hit_the_tank_owning_their_cell():
+    tanks = game.Tanks(display=NullDisplay())
+    player = tanks.tank
+    first = game.Tank(game.Dot(0, 6), lives=1, origin=0)
+    second = game.Tank(game.Dot(1, 7), lives=1, origin=1)
+    tanks.enemies = [first, second]
+
+    player.missiles.add(1, 8)
+    player.missiles.add(7, 30)
+    second.missiles.add(3, 9)
+    first.missiles.add(player.pos.x + 2, player.pos.y)
+    tanks.stamp_tanks()
+    tanks.resolve_hits()
+
+    assert (first.lives, second.lives, player.lives) == (0, 1, 2)
+    assert len(player.missiles) == 1
+    assert len(second.missiles) == 1
+    assert len(first.missiles) == 0
+
+
+def test_scheduler_carries_work_over_frames():
+    done = []
+
+    def jobs():
+        for idx in range(5):
+            done.append(idx)
+            yield
+
+    inputs = RandomInputs()
+    scheduler = game.Scheduler(budget_us=0)
+    scheduler.start(jobs())
+    frames = 0
+    while scheduler.busy():
+        scheduler.run(inputs)
+        frames += 1
+    assert done == [0, 1, 2, 3, 4]
+    assert frames == 6
+    assert scheduler.carried == 5
+
+    scheduler = game.Scheduler()
+    scheduler.start(jobs())
+    scheduler.run(inputs)
+    assert not scheduler.busy()
+
+
+def test_tanks_ai_within_a_frame_budget():
+    game.rng.seed(3)
+    tanks = game.Tanks(display=NullDisplay())
+    # A job per frame, every AI round spans frames
+    tanks.scheduler.budget_us = 0
+    inputs = RandomInputs(3)
+    for _ in range(2000):
+        if not tanks.step(inputs):
+            break
+    assert tanks.scheduler.carried > 0
+    assert tanks.scheduler.rounds > 1
+    assert tanks.enemies or tanks.score
+
+
+def test_races_road_scrolls_as_a_ring():
+    races = game.Races(display=NullDisplay())
+    start = bytes(races.road.content)
+    races.obstacles.add(2, 4)
+
+    races.scroll_road()
+    expected = game.FrameBuffer(bytearray(start))
+    expected.scroll(1)
+    expected.set(0, 0, start[-game.SCREEN_WIDTH])
+    expected.set(game.SCREEN_WIDTH - 1, 0, start[-1])
+    assert races.road.equals(expected)
+
+    for _ in range(game.SCREEN_HEIGHT - 1):
+        races.scroll_road()
+    assert races.scrolled == 0
+    assert bytes(races.road.content) == start
+    # Gone once it scrolled off the bottom, wherever the ring was
+    assert len(races.obstacles) == 0
+
+    # Keeps its screen row when the ring goes round under it
+    for _ in range(10):
+        races.scroll_road()
+    races.obstacles.add(2, -races.scrolled)
+    for _ in range(game.SCREEN_HEIGHT - 5):
+        races.scroll_road()
+    assert races.scrolled == 5
+    assert races.obstacles.y[0] + races.scrolled == game.SCREEN_HEIGHT - 5
+
+
+def test_replay_reproduces_recorded_session():
+    for idx, (_, game_class) in enumerate(game.GAMES):
+        stream = io.BytesIO()
+        recorder = game.InputRecorder(RandomInputs(3), stream, idx, 1234, size=16)
+        game.rng.seed(1234)
+        recorded = game_class(display=NullDisplay())
+        for _ in range(500):
+            alive = recorded.step(recorder)
+            if not alive:
+                break
+            recorder.end_tick()
+        recorder.close()
+
+        result = replay(stream.getvalue())
+        assert result["ticks"] == recorder.ticks, game_class.__name__
+        assert result["over"] == (not alive)
+        assert result["instance"].screen.equals(recorded.screen), game_class.__name__
+
+
+class SlowTime:
+    """Clock of a slow board: every ticks_us() call takes 5ms"""
+
+    def __init__(self, real):
+        self.real = real
+        self.us = 0
+
+    def ticks_us(self):
+        self.us += 5000
+        return self.us
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+
+def test_replay_reproduces_budgeted_tanks_ai():
+    idx = [game_class for _, game_class in game.GAMES].index(game.Tanks)
+    stream = io.BytesIO()
+    recorder = game.InputRecorder(RandomInputs(5), stream, idx, 99, size=16)
+    game.rng.seed(99)
+    real_time = game.time
+    game.time = SlowTime(real_time)
+    try:
+        recorded = game.Tanks(display=NullDisplay())
+        # Two or three jobs a frame on the slow clock
+        recorded.scheduler.budget_us = 12000
+        for _ in range(1500):
+            alive = recorded.step(recorder)
+            if not alive:
+                break
+            recorder.end_tick()
+    finally:
+        game.time = real_time
+    recorder.close()
+    # The AI ran out of its budget, the replay has none and follows the log
+    assert recorded.scheduler.carried > 0
+    assert game.Tanks.AI_BUDGET_US is None
+
+    result = replay(stream.getvalue())
+    replayed = result["instance"]
+    assert result["ticks"] == recorder.ticks
+    assert result["over"] == (not alive)
+    assert replayed.scheduler.steps == recorded.scheduler.steps
+    assert replayed.scheduler.carried == recorded.scheduler.carried
+    assert (replayed.score, replayed.tank.lives) == (recorded.score, recorded.tank.lives)
+    assert replayed.screen.equals(recorded.screen)
+
+
+def test_frame_capture_round_trip():
+    frames = []
+    recorder = game.FrameRecorder(io.BytesIO(), size=64)
+
+    def display(screen):
+        recorder.capture(screen)
+        frames.append(bytes(screen.content))
+
+    game.rng.seed(5)
+    run_headless(game.Tetris, 300, RandomInputs(5), display)
+    recorder.flush()
+    data = recorder.stream.getvalue()
+    assert len(data) == recorder.bytes
+    assert len(data) < len(frames) * game.SCREEN_SIZE // 10
+
+    reader = FrameReader(data)
+    assert list(reader) == frames
+    for idx in (len(frames) - 1, 3, 70, 69, 200):
+        assert reader.frame(idx) == frames[idx]
+
+    assert first_difference(reader, FrameReader(data)) is None
+    changed = bytearray(data)
+    changed[-1] ^= 0x01
+    assert first_difference(reader, FrameReader(bytes(changed))) == len(frames) - 1
+
+
+if __name__ == "__main__":
+    test_every_game_survives_random_input()
+    test_step_reports_game_over()
+    test_snake_ring_matches_occupancy_bitmap()
+    test_flow_field_leads_every_tank_to_the_target()
+    test_line_of_sight_uses_occupancy_masks()
+    test_missiles_hit_the_tank_owning_their_cell()
+    test_scheduler_carries_work_over_frames()
+    test_tanks_ai_within_a_frame_budget()
+    test_races_road_scrolls_as_a_ring()
+    test_replay_reproduces_recorded_session()
+    test_replay_reproduces_budgeted_tanks_ai()
+    test_frame_capture_round_trip()
+    print("All tests completed!")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for the desktop machine.py keyboard input
+"""
+
+from harness import load_module
+
+machine = load_module("machine_terminal", "machine.py")
+
+
+def test_axes_consume_only_their_own_keys():
+    ip = machine.ip
+    ip.events = machine.EventQueue()
+    x = machine.ADC(27)
+    y = machine.ADC(28)
+
+    ip.feed(b"\x1b[D\x1b[A\x1b[")
+    ip.feed(b"Bq\x1b[C")
+    assert len(ip.events) == 4
+    assert y.read_u16() == 1
+    assert y.read_u16() == 65000
+    assert y.read_u16() == machine.NEUTRAL
+    assert x.read_u16() == 65000
+    assert x.read_u16() == 1
+    assert x.read_u16() == machine.NEUTRAL
+    assert ip.events.taken == 4
+
+
+def test_key_repeat_is_not_lost():
+    events = machine.EventQueue(size=8)
+    for n in range(6):
+        events.push("left" if n % 2 else "up")
+    assert [events.take(("left",)) for _ in range(4)] == ["left"] * 3 + [None]
+    assert [events.take(("up",)) for _ in range(4)] == ["up"] * 3 + [None]
+    assert events.dropped == 0
+
+    for n in range(10):
+        events.push("down")
+    assert len(events) == 8
+    assert events.dropped == 2
+    assert events.latency_max >= 0
+
+
+def test_enter_calls_the_button_handler():
+    pressed = []
+    pin = machine.Pin(16, machine.Pin.IN, machine.Pin.PULL_UP)
+    pin.irq(trigger=machine.Pin.IRQ_RISING, handler=pressed.append)
+    machine.ip.feed(b"\r")
+    assert pressed == ["enter"]
+
+
+def test_p_holds_the_button_down():
+    pressed = []
+    pin = machine.Pin(16, machine.Pin.IN, machine.Pin.PULL_UP)
+    pin.irq(trigger=machine.Pin.IRQ_RISING, handler=pressed.append)
+    assert pin.value() == 1
+    machine.ip.feed(b"p")
+    assert pin.value() == 0
+    assert pressed == []
+
+    # Released once the hold is over, which the IRQ sees as a press
+    machine.ip.held_until -= machine.HOLD_SECONDS
+    assert pin.value() == 1
+    assert pressed == ["enter"]
+    assert pin.value() == 1
+    assert pressed == ["enter"]
+
+
+if __name__ == "__main__":
+    test_axes_consume_only_their_own_keys()
+    test_key_repeat_is_not_lost()
+    test_enter_calls_the_button_handler()
+    test_p_holds_the_button_down()
+    print("All tests completed!")
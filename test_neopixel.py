@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Tests for the desktop neopixel.py terminal panel
+"""
+
+import io
+import re
+import sys
+import random
+
+from harness import load_terminal
+
+neopixel = load_terminal()
+
+# A CSI sequence, or one printed character
+TOKEN = re.compile(r"\x1b\[([0-9;]*)([A-Za-z])|(.)", re.DOTALL)
+
+
+class Terminal:
+    """The part of a terminal the panel writes to: cursor moves, SGR colors and text"""
+
+    def __init__(self, rows: int, columns: int):
+        self.cells = [[None] * columns for _ in range(rows)]
+        self.row = 0
+        self.column = 0
+        self.fg = None
+        self.bg = None
+
+    def feed(self, data: str):
+        for match in TOKEN.finditer(data):
+            params, command, ch = match.groups()
+            if ch == "\n":
+                self.row += 1
+            elif ch == "\r":
+                self.column = 0
+            elif ch is not None:
+                self.cells[self.row][self.column] = (self.fg, self.bg)
+                self.column += 1
+            elif command == "A":
+                self.row -= int(params)
+            elif command == "B":
+                self.row += int(params)
+            elif command == "G":
+                self.column = int(params) - 1
+            elif command == "m":
+                values = [int(v) for v in params.split(";")]
+                if values == [0]:
+                    self.fg = self.bg = None
+                elif values[:2] == [38, 2]:
+                    self.fg = tuple(values[2:])
+                elif values[:2] == [48, 2]:
+                    self.bg = tuple(values[2:])
+                else:
+                    raise ValueError("unexpected SGR {}".format(params))
+            else:
+                raise ValueError("unexpected sequence {}{}".format(params, command))
+
+
+def write(panel) -> str:
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        panel.write()
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def assert_shows(terminal, panel):
+    rows = panel.hieght // 2
+    for row in range(rows):
+        for x in range(panel.width):
+            upper, lower = panel.cell(x, row)
+            expected = (tuple(c * 20 for c in upper), tuple(c * 20 for c in lower))
+            for column in range(x * panel.scale, (x + 1) * panel.scale):
+                assert terminal.cells[row][column] == expected, (x, row)
+    # Back on the line below the panel
+    assert (terminal.row, terminal.column) == (rows, 0)
+
+
+def test_write_redraws_only_changed_cells():
+    panel = neopixel.NeoPixel(None, 256)
+    terminal = Terminal(panel.hieght // 2 + 1, panel.width * panel.scale)
+    rng = random.Random(5)
+    for idx in range(256):
+        panel[idx] = (rng.randrange(10), rng.randrange(10), rng.randrange(10))
+
+    first = write(panel)
+    assert first.startswith("\n" * (panel.hieght // 2))
+    terminal.feed(first)
+    assert_shows(terminal, panel)
+
+    for _ in range(5):
+        for _ in range(rng.randrange(1, 12)):
+            panel[rng.randrange(256)] = (rng.randrange(10), 0, rng.randrange(10))
+        data = write(panel)
+        assert 0 < len(data) < len(first)
+        terminal.feed(data)
+        assert_shows(terminal, panel)
+
+    # A whole character row in one color: one move and one pen
+    for idx in range(32, 48):
+        panel[idx] = (4, 4, 0)
+    data = write(panel)
+    assert data.count("G") == 1
+    assert data.count("\x1b[38;2;") == 1
+    terminal.feed(data)
+    assert_shows(terminal, panel)
+
+    assert write(panel) == ""
+    assert panel.bytes_last == 0
+
+
+if __name__ == "__main__":
+    test_write_redraws_only_changed_cells()
+    print("All tests completed!")